@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Benchmarks QS02: medias synthetiques (ffmpeg -f lavfi) et mesure des chemins critiques.
+
+- Scan de l'inventaire (arborescence de fichiers factices).
+- probe() sans cache, cache froid, cache chaud.
+- Nettoyage des noms (clean_filename / extract_movie_info) sur un corpus genere.
+- Planification (plan des flux + commande ffmpeg) et encodage logiciel de bout en bout.
+
+Resultats en JSON (BENCH_OUTPUT) pour comparer les versions entre elles.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import QS02_inventaire as inventaire
+import QS02_vid_normaliser as normaliser
+from QS02_probe_cache import ProbeCache
+
+# =========================
+# CONFIG
+# =========================
+BENCH_OUTPUT = Path("./bench_output.json")
+BENCH_WORKDIR = None  # None = dossier temporaire supprime en fin de run
+
+MEDIA_SECONDS = 4
+MEDIA_SIZE = "640x360"
+SCAN_FILES = 20_000
+SCAN_FILES_PER_DIR = 50
+PROBE_ROUNDS = 3
+NAME_CORPUS = 20_000
+PLAN_ROUNDS = 2_000
+ENCODE_SECONDS = 4
+SOFTWARE_ENCODERS = ["libsvtav1", "libx265", "libaom-av1"]
+
+# Sources synthetiques: (nom de fichier, HDR, transfert, pix_fmt, primaries/matrix)
+MEDIA_SPECS = [
+    ("Le.Grand.Film.2019.1080p.BluRay.x264.DTS-GRP.mkv", False, "bt709", "yuv420p", ("bt709", "bt709")),
+    ("Another.Movie.2021.2160p.UHD.HDR10.HEVC.TrueHD.7.1-TEAM.mkv", True, "smpte2084", "yuv420p10le", ("bt2020", "bt2020nc")),
+    ("Live.Concert.2020.2160p.HLG.WEB-DL.mkv", True, "arib-std-b67", "yuv420p10le", ("bt2020", "bt2020nc")),
+    ("Old.Classic.1964.REMASTERED.720p.x264-OLD.mkv", False, "bt709", "yuv422p", ("bt709", "bt709")),
+]
+
+TITLE_WORDS = ["Le", "La", "Les", "Star", "Night", "Dark", "Return", "of", "the", "King", "Amelie", "Matrix", "Dune"]
+TECH_TOKENS = [
+    "1080p", "2160p", "720p", "BluRay", "WEB-DL", "WEBRip", "REMUX", "x264", "x265", "HEVC", "H.264",
+    "HDR10", "HDR", "DV", "DTS-HD", "TrueHD", "AC3", "AAC", "DD5.1", "7.1", "MULTI", "10bit", "AMZN", "NF",
+]
+GROUPS = ["GRP", "FraMeSToR", "SPARKS", "TEAM", "QTZ"]
+# Filters assumed present for the planning benchmark (no GPU needed to plan)
+DEVICE_FILTERS = {"scale_cuda", "scale_vaapi", "vpp_qsv"}
+
+
+def pick_codec(available: set[str], preferred: list[str]) -> str | None:
+    return next((c for c in preferred if c in available), None)
+
+
+def generate_media(ffmpeg: str, media_dir: Path, available: set[str]) -> list[Path]:
+    media_dir.mkdir(parents=True, exist_ok=True)
+    files = []
+    for name, hdr, trc, pix_fmt, (primaries, matrix) in MEDIA_SPECS:
+        vcodec = pick_codec(available, ["libx265", "ffv1"] if hdr or pix_fmt != "yuv420p" else ["libx264", "mpeg4"])
+        if vcodec is None:
+            print(f"WARNING: aucun encodeur pour {name}, ignore")
+            continue
+        outp = media_dir / name
+        d = MEDIA_SECONDS
+        cmd = [ffmpeg, "-hide_banner", "-v", "error", "-y"]
+        cmd += ["-f", "lavfi", "-i", f"testsrc2=size={MEDIA_SIZE}:rate=24000/1001:duration={d}"]
+        cmd += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={d}"]
+        cmd += ["-f", "lavfi", "-i", f"sine=frequency=880:sample_rate=48000:duration={d}"]
+        cmd += ["-map", "0:v", "-map", "1:a", "-map", "2:a", "-c:v", vcodec, "-pix_fmt", pix_fmt]
+        cmd += ["-color_primaries", primaries, "-color_trc", trc, "-colorspace", matrix]
+        # Track 0: French 5.1, track 1: English stereo
+        cmd += ["-c:a:0", "ac3", "-ac:a:0", "6", "-c:a:1", "aac", "-ac:a:1", "2"]
+        cmd += ["-metadata:s:a:0", "language=fre", "-metadata:s:a:1", "language=eng", str(outp)]
+        rc, _, err = normaliser.cap(cmd)
+        if rc != 0:
+            print(f"WARNING: generation echouee ({name}): {err.strip()[-200:]}")
+            continue
+        files.append(outp)
+    return files
+
+
+def bench_scan(root: Path) -> dict:
+    # Empty files are enough: the scan never opens them
+    for i in range(SCAN_FILES):
+        d = root / f"dir_{i // SCAN_FILES_PER_DIR:04d}"
+        if i % SCAN_FILES_PER_DIR == 0:
+            d.mkdir(parents=True, exist_ok=True)
+            (d / "cover.jpg").touch()
+        (d / f"Film.{i}.2020.1080p{'.mkv' if i % 3 else '.MP4'}").touch()
+    t0 = time.perf_counter()
+    found = sum(1 for _ in inventaire.scan_video_files(root))
+    elapsed = time.perf_counter() - t0
+    return {"files": found, "seconds": round(elapsed, 4), "files_per_s": round(found / elapsed, 1)}
+
+
+def bench_probe(ffprobe: str, files: list[Path], cache_file: Path) -> dict:
+    def run(cache: ProbeCache | None) -> float:
+        t0 = time.perf_counter()
+        for _ in range(PROBE_ROUNDS):
+            for f in files:
+                inventaire.probe(ffprobe, f, cache)
+        return (time.perf_counter() - t0) / (PROBE_ROUNDS * len(files))
+
+    no_cache = run(None)
+    cache = ProbeCache(cache_file)
+    t0 = time.perf_counter()
+    for f in files:
+        inventaire.probe(ffprobe, f, cache)
+    cold = (time.perf_counter() - t0) / len(files)
+    warm = run(cache)
+    cache.close()
+    return {
+        "files": len(files),
+        "no_cache_ms": round(no_cache * 1000, 3),
+        "cache_cold_ms": round(cold * 1000, 3),
+        "cache_warm_ms": round(warm * 1000, 3),
+        "speedup": round(no_cache / warm, 1) if warm > 0 else None,
+    }
+
+
+def name_corpus(n: int) -> list[str]:
+    rng = random.Random(42)
+    names = []
+    for i in range(n):
+        title = ".".join(rng.sample(TITLE_WORDS, rng.randint(1, 4)))
+        parts = [title]
+        if rng.random() < 0.8:
+            parts.append(str(rng.randint(1950, 2025)))
+        if rng.random() < 0.2:
+            parts.append(f"S{rng.randint(1, 12):02d}E{rng.randint(1, 24):02d}")
+        parts += rng.sample(TECH_TOKENS, rng.randint(2, 6))
+        name = ".".join(parts)
+        if rng.random() < 0.7:
+            name += f"-{rng.choice(GROUPS)}"
+        if rng.random() < 0.2:
+            name = name.replace(".", " ")
+        names.append(name + rng.choice([".mkv", ".mp4", ".m4v"]))
+    return names
+
+
+def bench_names(names: list[str]) -> dict:
+    # First pass = real cost per name (memo caches cleared), second pass = memoized lookups
+    results = {"names": len(names), "unique": len(set(names))}
+    stems = [Path(name).stem for name in names]
+    for label, func, inputs in (
+        ("clean_filename", normaliser.clean_filename, stems),
+        ("extract_movie_info", normaliser.extract_movie_info, names),
+        ("parse_release_name", normaliser.parse_release_name, names),
+    ):
+        normaliser.clean_filename.cache_clear()
+        normaliser.parse_release_name.cache_clear()
+        timings = []
+        for _ in range(2):
+            t0 = time.perf_counter()
+            for value in inputs:
+                func(value)
+            timings.append(time.perf_counter() - t0)
+        results[label] = {
+            "seconds": round(timings[0], 4),
+            "us_per_name": round(timings[0] / len(names) * 1e6, 2),
+            "us_per_name_memoized": round(timings[1] / len(names) * 1e6, 2),
+        }
+    return results
+
+
+def bench_plan(ffprobe: str, files: list[Path], backend: normaliser.EncoderBackend) -> dict:
+    probed = [(f, *normaliser.probe(ffprobe, f)) for f in files]
+    t0 = time.perf_counter()
+    count = 0
+    for _ in range(PLAN_ROUNDS // max(1, len(probed))):
+        for f, streams, format_info in probed:
+            v = normaliser.first(streams, "video")
+            best = normaliser.best_audio(streams)
+            hdr, trc = normaliser.is_hdr(v)
+            copy_video, issues = inventaire.check_qs02_compatibility(format_info, v)
+            pipeline = normaliser.plan_video_pipeline(backend, v, hdr, DEVICE_FILTERS, normaliser.MAX_HEIGHT)
+            bitrate, _ = normaliser.target_bitrate(v, streams, format_info, hdr, pipeline.size)
+            normaliser.plan_streams(best, streams, copy_video, issues, backend.encoder)
+            normaliser.ffmpeg_cmd(
+                "ffmpeg", f, f.with_suffix(".out.mkv"), hdr, trc, best, streams, backend, copy_video, bitrate, pipeline
+            )
+            count += 1
+    elapsed = time.perf_counter() - t0
+    return {"plans": count, "us_per_plan": round(elapsed / max(1, count) * 1e6, 2)}
+
+
+def bench_encode(ffmpeg: str, ffprobe: str, files: list[Path], out_dir: Path, available: set[str]) -> dict:
+    encoder = pick_codec(available, SOFTWARE_ENCODERS)
+    if encoder is None:
+        return {"skipped": "aucun encodeur logiciel (libsvtav1, libx265, libaom-av1)"}
+    backend = normaliser.ENCODER_BACKENDS[encoder]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    results = {"encoder": encoder, "files": []}
+    for f in files:
+        streams, format_info = normaliser.probe(ffprobe, f)
+        v = normaliser.first(streams, "video")
+        best = normaliser.best_audio(streams)
+        hdr, trc = normaliser.is_hdr(v)
+        outp = out_dir / f"{f.stem}.{encoder}.mkv"
+        cmd = normaliser.ffmpeg_cmd(ffmpeg, f, outp, hdr, trc, best, streams, backend)
+        cmd = [cmd[0], "-t", str(ENCODE_SECONDS), *cmd[1:]]
+        t0 = time.perf_counter()
+        rc, _, err = normaliser.cap(cmd)
+        elapsed = time.perf_counter() - t0
+        duration = min(float(format_info.get("duration") or 0), ENCODE_SECONDS)
+        frames = duration * normaliser.parse_fps(v)
+        results["files"].append(
+            {
+                "source": f.name,
+                "hdr": hdr,
+                "ok": rc == 0,
+                "seconds": round(elapsed, 3),
+                "fps": round(frames / elapsed, 1) if rc == 0 else None,
+                "realtime": round(duration / elapsed, 2) if rc == 0 else None,
+                "error": err.strip()[-200:] if rc != 0 else None,
+            }
+        )
+    return results
+
+
+def tool_version(binary: str | None) -> str | None:
+    if not binary:
+        return None
+    rc, out, _ = normaliser.cap([binary, "-version"])
+    return out.splitlines()[0] if rc == 0 and out else None
+
+
+def git_revision() -> str | None:
+    try:
+        p = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent
+        )
+    except OSError:
+        return None
+    return p.stdout.strip() or None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks QS02 (resultats JSON).")
+    parser.add_argument("--out", type=Path, default=BENCH_OUTPUT)
+    parser.add_argument("--workdir", type=Path, default=BENCH_WORKDIR)
+    parser.add_argument("--skip-encode", action="store_true", help="sans encodage de bout en bout")
+    args = parser.parse_args()
+
+    ffmpeg = shutil.which("ffmpeg")
+    ffprobe = shutil.which("ffprobe")
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="qs02_bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    report: dict = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": tool_version(ffmpeg),
+        "results": {},
+    }
+    results = report["results"]
+    try:
+        print("Scan...")
+        results["scan"] = bench_scan(workdir / "scan")
+        print("Noms...")
+        results["names"] = bench_names(name_corpus(NAME_CORPUS))
+
+        if not ffmpeg or not ffprobe:
+            print("WARNING: ffmpeg/ffprobe introuvables, benchmarks media ignores")
+            for key in ("probe", "plan", "encode"):
+                results[key] = {"skipped": "ffmpeg/ffprobe introuvables"}
+        else:
+            available = normaliser.list_encoders(ffmpeg)
+            print("Generation des medias synthetiques...")
+            files = generate_media(ffmpeg, workdir / "media", available)
+            results["media"] = [f.name for f in files]
+            if files:
+                print("Probe...")
+                results["probe"] = bench_probe(ffprobe, files, workdir / "probe_cache.sqlite")
+                print("Planification...")
+                results["plan"] = bench_plan(ffprobe, files, normaliser.ENCODER_BACKENDS["av1_nvenc"])
+                if args.skip_encode:
+                    results["encode"] = {"skipped": "--skip-encode"}
+                else:
+                    print("Encodage...")
+                    results["encode"] = bench_encode(ffmpeg, ffprobe, files, workdir / "encoded", available)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    args.out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    print(f"\nResultats: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
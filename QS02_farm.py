@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Ferme d'encodage QS02: un coordinateur et des workers (une ou plusieurs machines).
+
+Les jobs vivent dans un repertoire partage (FARM_DIR, ex: partage NFS/SMB monte sur chaque machine):
+- queue/   : jobs en attente (un fichier JSON par source)
+- leases/  : jobs pris par un worker (prise = rename atomique depuis queue/)
+- done/    : jobs termines (ou ignores), failed/ : jobs en echec (remis en file au prochain coordinateur)
+- workers/ : etat de chaque worker (job courant, progression ffmpeg)
+
+Un worker rafraichit le mtime de son bail toutes les FARM_HEARTBEAT_SECONDS. Le coordinateur
+remet en file les baux dont le mtime n'a pas bouge depuis FARM_LEASE_TIMEOUT, mesure sur sa propre
+horloge (worker tue, machine eteinte; les horloges des machines peuvent differer). Un worker dont le
+bail a ete repris arrete son encodage en cours.
+
+Usage:
+    python QS02_farm.py coordinator [dossier|inventaire.tsv] [--local-workers N] [--encodeur libx265]
+    python QS02_farm.py worker [--id NOM] [--encodeur libx265]
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import QS02_vid_normaliser as normaliser
+from QS02_metrics import METRICS
+from QS02_probe_cache import open_cache
+from QS02_runner import RUNNER, RunInterrupted
+
+# =========================
+# CONFIG (MODIFIER ICI)
+# =========================
+
+# Repertoire d'etat partage par le coordinateur et tous les workers
+FARM_DIR = normaliser.OUT_DIR / "qs02_farm"
+
+# Battement de coeur du worker, et delai sans battement avant remise en file du job
+FARM_HEARTBEAT_SECONDS = 5
+FARM_LEASE_TIMEOUT = 60
+
+# Un job remis en file plus de FARM_MAX_ATTEMPTS fois (worker mort a chaque fois) passe en echec
+FARM_MAX_ATTEMPTS = 3
+
+# Attente entre deux passages du coordinateur / deux recherches de job par un worker inoccupe
+FARM_POLL_SECONDS = 2
+FARM_STATUS_SECONDS = 30
+
+# =========================
+FARM_STATES = ("queue", "leases", "done", "failed", "workers")
+
+
+def state_dir(state: str) -> Path:
+    return FARM_DIR / state
+
+
+def job_id(source: Path) -> str:
+    return hashlib.sha1(str(source).encode("utf-8")).hexdigest()[:16]
+
+
+def job_files(state: str) -> list[Path]:
+    # Hidden names are temporary files or jobs being requeued
+    try:
+        names = sorted(n for n in os.listdir(state_dir(state)) if n.endswith(".json") and not n.startswith("."))
+    except FileNotFoundError:
+        return []
+    return [state_dir(state) / n for n in names]
+
+
+def read_json(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def write_json(path: Path, data: dict) -> None:
+    # Unique temp name per writer: several threads and machines may write the same file
+    tmp = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def init_farm() -> None:
+    for state in FARM_STATES:
+        state_dir(state).mkdir(parents=True, exist_ok=True)
+
+
+# ---------- Coordinator ----------
+
+
+def enqueue(sources: list[Path]) -> int:
+    # Like the local batch, a failed job is tried again by the next run (attempts start over)
+    known = {p.name for state in ("queue", "leases") for p in job_files(state)}
+    for p in job_files("done"):
+        # A dry run leaves the job to do for real later
+        job = read_json(p)
+        if job and not job.get("dry_run"):
+            known.add(p.name)
+    added = 0
+    for src in sources:
+        name = f"{job_id(src)}.json"
+        if name in known:
+            continue
+        known.add(name)
+        (state_dir("done") / name).unlink(missing_ok=True)
+        (state_dir("failed") / name).unlink(missing_ok=True)
+        job = {"id": name[:-5], "source": str(src), "attempts": 0, "added": time.strftime("%Y-%m-%d %H:%M:%S")}
+        write_json(state_dir("queue") / name, job)
+        added += 1
+    return added
+
+
+def requeue_stale(seen: dict[str, tuple[float, float]]) -> list[str]:
+    # seen: lease name -> (last mtime, coordinator time it was first seen). Only changes of the
+    # mtime count, never its value: the workers' clocks may differ from ours
+    now = time.monotonic()
+    events = []
+    leases = job_files("leases")
+    for name in set(seen) - {lease.name for lease in leases}:
+        del seen[name]
+    for lease in leases:
+        try:
+            mtime = lease.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        last = seen.get(lease.name)
+        if last is None or last[0] != mtime:
+            seen[lease.name] = (mtime, now)
+            continue
+        age = now - last[1]
+        if age < FARM_LEASE_TIMEOUT:
+            continue
+        del seen[lease.name]
+        # Move aside first: a late worker can then neither finish nor heartbeat this lease
+        parked = state_dir("queue") / f".{lease.name}.requeue"
+        try:
+            os.rename(lease, parked)
+        except FileNotFoundError:
+            continue
+        job = read_json(parked) or {"id": lease.stem, "source": None, "attempts": 0}
+        worker = job.pop("worker", None)
+        job.pop("claimed", None)
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["error"] = f"bail expire ({worker}, {age:.0f}s sans battement)"
+        if job["attempts"] >= FARM_MAX_ATTEMPTS:
+            job["status"] = "failed"
+            write_json(state_dir("failed") / lease.name, job)
+            events.append(f"ECHEC: {job['source']} ({job['attempts']} tentatives)")
+        else:
+            write_json(state_dir("queue") / lease.name, job)
+            events.append(f"REMIS EN FILE: {job['source']} ({job['error']})")
+        parked.unlink(missing_ok=True)
+    return events
+
+
+def print_status() -> None:
+    counts = {state: len(job_files(state)) for state in ("queue", "leases", "done", "failed")}
+    print(
+        f"[{time.strftime('%H:%M:%S')}] attente={counts['queue']} en cours={counts['leases']} "
+        f"termines={counts['done']} echecs={counts['failed']}",
+        flush=True,
+    )
+    # A killed worker leaves its last status behind: only show workers that still hold their lease
+    holders = {p.stem: (read_json(p) or {}).get("worker") for p in job_files("leases")}
+    for p in job_files("workers"):
+        status = read_json(p)
+        if not status or not status.get("job") or holders.get(status["job"]) != status.get("worker"):
+            continue
+        pct = f"{status['percent']:.1f}%" if status.get("percent") is not None else "?"
+        eta = time.strftime("%H:%M:%S", time.gmtime(status["eta_s"])) if status.get("eta_s") is not None else "?"
+        print(f"  {status['worker']}: {Path(status['source']).name} {status.get('step') or ''} {pct} ETA {eta}")
+
+
+def spawn_workers(count: int, encoder: str | None) -> list[subprocess.Popen]:
+    cmd = [sys.executable, str(Path(__file__).resolve()), "worker"]
+    if encoder:
+        cmd += ["--encodeur", encoder]
+    host = socket.gethostname()
+    return [subprocess.Popen(cmd + ["--id", f"{host}-local{i}"]) for i in range(count)]
+
+
+def coordinator_main(args: argparse.Namespace) -> None:
+    target = args.cible or normaliser.IN_DIR
+    if not target.exists():
+        raise SystemExit(f"ERROR: Fichier introuvable: {target}")
+    init_farm()
+    added = enqueue([src.resolve() for src in normaliser.collect_sources(target)])
+    print(f"Ferme: {added} job(s) ajoute(s), {len(job_files('queue'))} en attente ({FARM_DIR})")
+
+    workers = spawn_workers(args.local_workers, args.encodeur)
+    seen: dict[str, tuple[float, float]] = {}
+    last_status = 0.0
+    try:
+        while True:
+            now = time.monotonic()
+            for event in requeue_stale(seen):
+                print(event, flush=True)
+            if now - last_status >= FARM_STATUS_SECONDS:
+                last_status = now
+                print_status()
+            if not job_files("queue") and not job_files("leases"):
+                break
+            if workers and all(w.poll() is not None for w in workers):
+                print("WARNING: tous les workers locaux se sont arretes")
+                break
+            time.sleep(FARM_POLL_SECONDS)
+    finally:
+        for w in workers:
+            w.wait()
+
+    jobs = [read_json(p) or {} for p in job_files("done")]
+    skipped = sum(1 for job in jobs if job.get("status") == "skipped")
+    print(
+        f"\nFerme terminee: {len(jobs) - skipped} ok, {skipped} ignore(s), "
+        f"{len(job_files('failed'))} echec(s), {len(job_files('queue'))} en attente"
+    )
+
+
+# ---------- Worker ----------
+
+
+def claim_job() -> Path | None:
+    for p in job_files("queue"):
+        lease = state_dir("leases") / p.name
+        try:
+            # rename keeps the mtime: refresh it first so the lease does not look expired
+            os.utime(p)
+            os.rename(p, lease)
+        except FileNotFoundError:
+            continue  # taken by another worker
+        return lease
+    return None
+
+
+def finish_job(lease: Path, job: dict, state: str) -> bool:
+    dest = state_dir(state) / lease.name
+    try:
+        os.rename(lease, dest)
+    except FileNotFoundError:
+        # The coordinator requeued it meanwhile (lease expired)
+        return False
+    job["finished"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    write_json(dest, job)
+    return True
+
+
+class Heartbeat:
+    # Keeps the lease alive and publishes the ffmpeg progress of the current job
+    def __init__(self, worker: str) -> None:
+        self.worker = worker
+        self.status_path = state_dir("workers") / f"{worker}.json"
+        self.lease: Path | None = None
+        self.job: dict = {}
+        self.progress: dict = {}
+        self.lost = False
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        normaliser.add_progress_listener(self.on_progress)
+
+    def start(self) -> None:
+        self.publish()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.status_path.unlink(missing_ok=True)
+
+    def set_job(self, lease: Path | None, job: dict) -> None:
+        with self._lock:
+            if self.lost:
+                RUNNER.resume()
+            self.lease = lease
+            self.job = job
+            self.progress = {}
+            self.lost = False
+        self.publish()
+
+    def on_progress(self, event: dict) -> None:
+        with self._lock:
+            self.progress = event
+
+    def publish(self) -> None:
+        # Called from the worker thread and the heartbeat thread
+        with self._lock:
+            progress = dict(self.progress)
+            job = dict(self.job)
+        status = {
+            "worker": self.worker,
+            "pid": os.getpid(),
+            "ts": round(time.time(), 3),
+            "job": job.get("id"),
+            "source": job.get("source"),
+            "step": progress.get("step"),
+            "percent": progress.get("percent"),
+            "speed": progress.get("speed"),
+            "eta_s": progress.get("eta_s"),
+        }
+        with self._publish_lock:
+            write_json(self.status_path, status)
+
+    def _run(self) -> None:
+        while not self._stop.wait(FARM_HEARTBEAT_SECONDS):
+            with self._lock:
+                lease = self.lease
+            if lease is not None and not self.lost:
+                try:
+                    # utime never recreates a lease the coordinator took back
+                    os.utime(lease)
+                except FileNotFoundError:
+                    self.on_lost(lease)
+            try:
+                self.publish()
+            except OSError as e:
+                # A share hiccup must not stop the heartbeat thread
+                print(f"WARNING: etat du worker non publie: {e}", flush=True)
+
+    def on_lost(self, lease: Path) -> None:
+        with self._lock:
+            if self.lease != lease:
+                return  # the job ended meanwhile
+            self.lost = True
+            # Another worker owns the job now: stop writing to its .part/output files
+            RUNNER.interrupt()
+        print(f"WARNING: bail perdu (expire): {lease.name}, encodage arrete", flush=True)
+
+
+def worker_main(args: argparse.Namespace) -> None:
+    init_farm()
+    worker = args.id or f"{socket.gethostname()}-{os.getpid()}"
+    ffmpeg = normaliser.need("ffmpeg")
+    ffprobe = normaliser.need("ffprobe")
+    backend = normaliser.select_backend(ffmpeg, args.encodeur)
+    print(f"Worker {worker}: encodeur video {backend.encoder}", flush=True)
+    normaliser.OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    cache = open_cache(normaliser.PROBE_CACHE_FILE)
+    heartbeat = Heartbeat(worker)
+    heartbeat.start()
+    statuses: list[str] = []
+    try:
+        while True:
+            lease = claim_job()
+            if lease is None:
+                # Running leases may still come back if their worker dies
+                if not job_files("leases"):
+                    break
+                time.sleep(FARM_POLL_SECONDS)
+                continue
+            job = read_json(lease) or {"id": lease.stem}
+            job.update(worker=worker, claimed=time.strftime("%Y-%m-%d %H:%M:%S"))
+            write_json(lease, job)
+            heartbeat.set_job(lease, job)
+            inp = Path(job["source"]) if job.get("source") else None
+            print(f"[{worker}] job {job['id']}: {inp}", flush=True)
+
+            state = "done"
+            try:
+                if inp is None or not inp.exists():
+                    raise RuntimeError("source introuvable")
+                outp = normaliser.process_file(ffmpeg, ffprobe, inp, backend, cache, skip_existing=True)
+                job.update(status="done", output=str(outp), error=None, dry_run=normaliser.DRY_RUN)
+            except RunInterrupted:
+                if not heartbeat.lost:
+                    raise
+                # The lease holder now owns the outputs: leave them alone and record nothing
+                print(f"[{worker}] job {job['id']} abandonne (bail repris)", flush=True)
+                heartbeat.set_job(None, {})
+                continue
+            except normaliser.JobSkipped as e:
+                print(e)
+                job.update(status="skipped", error=str(e))
+            except Exception as e:
+                print(f"ERROR: {e}")
+                job.update(status="failed", error=str(e))
+                state = "failed"
+            heartbeat.set_job(None, {})
+            if not finish_job(lease, job, state):
+                print(f"WARNING: job {job['id']} deja remis en file, resultat non enregistre")
+            statuses.append(job["status"])
+    finally:
+        heartbeat.stop()
+        if cache:
+            cache.close()
+
+    print(
+        f"\nWorker {worker} termine: {statuses.count('done')} ok, {statuses.count('skipped')} ignore(s), "
+        f"{statuses.count('failed')} echec(s)"
+    )
+    METRICS.print_summary()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ferme d'encodage QS02 (coordinateur / workers).")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    coord = sub.add_parser("coordinator", help="construit la file de jobs et surveille les baux")
+    coord.add_argument("cible", nargs="?", type=Path, help="dossier source ou TSV d'inventaire (defaut: IN_DIR)")
+    coord.add_argument("--local-workers", type=int, default=0, metavar="N", help="lance N workers sur cette machine")
+    coord.add_argument("--encodeur", help="encodeur video des workers locaux (ex: libx265)")
+    work = sub.add_parser("worker", help="prend et encode des jobs jusqu'a epuisement de la file")
+    work.add_argument("--id", help="nom du worker (defaut: machine-pid)")
+    work.add_argument("--encodeur", help="encodeur video (defaut: VIDEO_ENCODER)")
+    args = parser.parse_args()
+    if args.mode == "coordinator":
+        coordinator_main(args)
+    else:
+        worker_main(args)
+
+
+if __name__ == "__main__":
+    main()
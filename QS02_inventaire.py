@@ -5,11 +5,26 @@ Inventaire des films dans X:\Flims pour QS02
 Determine quels films sont deja compatibles QS02 et lesquels necessitent une normalisation.
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import argparse
 import json
+import os
 import shutil
-import subprocess
+import sqlite3
 import sys
+import time
+
+from QS02_metrics import METRICS
+from QS02_probe_cache import open_cache
+from QS02_runner import kill_on_interrupt, run
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
 
 # =========================
 # CONFIG
@@ -23,18 +38,45 @@ QS02_VIDEO_CODECS = {"h264", "h265", "hevc"}  # QS02 supporte H264, H265 (HEVC)
 QS02_AUDIO_CODECS = {"ac3", "aac"}
 QS02_MAXRATE_HDR = 25_000_000  # 25M
 QS02_MAXRATE_SDR = 15_000_000  # 15M
-
-
-def cap(cmd):
-    p = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        encoding="utf-8",
-        errors="replace",
-    )
-    return p.returncode, p.stdout, p.stderr
+QS02_BUFSIZE_HDR = 50_000_000  # 50M (meme VBV que QS02_vid_normaliser)
+QS02_BUFSIZE_SDR = 30_000_000  # 30M
+
+# Analyse approfondie: pic de bitrate calcule paquet par paquet (ffprobe -show_packets) sur une
+# fenetre glissante BUFSIZE / MAXRATE (2s), compare a QS02_MAXRATE_*. Lit le fichier entier:
+# couteux, mais le resultat est garde dans PROBE_CACHE_FILE (une seule passe par fichier).
+DEEP_BITRATE_ANALYSIS = False
+
+# Cache ffprobe persistant (cle: chemin + taille + mtime). None = desactive.
+PROBE_CACHE_FILE = Path("./qs02_probe_cache.sqlite")
+
+# Nombre de ffprobe lances en parallele (limite aussi les lectures simultanees sur le NAS).
+PROBE_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+# Delai maximal (s) d'un ffprobe: un fichier reseau inaccessible est abandonne (processus tue, fichier
+# signale en erreur) au lieu de bloquer tout le scan. PEAK_SCAN_TIMEOUT pour la lecture complete de
+# DEEP_BITRATE_ANALYSIS. None = sans limite.
+PROBE_TIMEOUT = 60
+PEAK_SCAN_TIMEOUT = 3600
+
+# Mode incremental: les fichiers dont taille + mtime n'ont pas change depuis le dernier passage
+# reprennent le resultat de STATE_FILE sans etre re-analyses. Le rapport de changements
+# (ajouts, modifications, suppressions, statut OK <-> NON OK) est produit des que STATE_FILE existe.
+INCREMENTAL = False
+STATE_FILE = Path("./films_qs02_inventaire.state.json")
+CHANGES_FILE = Path("./films_qs02_inventaire.changes.tsv")
+
+# Exports de l'inventaire (INVENTORY_BASENAME + extension):
+# - "tsv": format historique (films_qs02_inventaire.tsv), trie OK puis NON OK.
+# - "jsonl", "sqlite": colonnes typees, ecrits au fil de l'analyse.
+# - "sqlite": index (codec, HDR, bitrate, hauteur, statut, codecs audio) utilise par la sous-commande
+#   "query" (python QS02_inventaire.py query --help), sans re-analyse des fichiers.
+# - "parquet": necessite pyarrow (ignore sinon).
+INVENTORY_BASENAME = Path("./films_qs02_inventaire")
+EXPORT_FORMATS = ("tsv", "sqlite")
+
+# Metriques de fin de run (temps par etape, percentiles, debit): resume console toujours affiche,
+# fichier .json ou .csv si METRICS_FILE est defini.
+METRICS_FILE = None
 
 
 def need(binname):
@@ -44,15 +86,26 @@ def need(binname):
     return p
 
 
-def probe(ffprobe, f):
-    rc, out, err = cap([ffprobe, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", str(f)])
-    if rc != 0 or out is None or not out.strip():
-        return None, None
-    try:
-        data = json.loads(out)
-        return data.get("streams", []), data.get("format", {})
-    except (json.JSONDecodeError, TypeError):
-        return None, None
+def probe(ffprobe, f, cache=None, st=None):
+    data = cache.get(f, st) if cache else None
+    if cache:
+        METRICS.count("cache_ffprobe_hit" if data is not None else "cache_ffprobe_miss")
+    if data is None:
+        cmd = [ffprobe, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", str(f)]
+        with METRICS.timer("ffprobe"):
+            result = run(cmd, timeout=PROBE_TIMEOUT, pool="probe")
+        if result.timed_out:
+            METRICS.count("ffprobe_timeout")
+        if not result.ok or not result.stdout.strip():
+            return None, None
+        try:
+            # Raw bytes straight to the parser, no decoded text copy
+            data = json.loads(result.stdout)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None, None
+        if cache:
+            cache.put(f, data, st)
+    return data.get("streams", []), data.get("format", {})
 
 
 def first(streams, t):
@@ -85,7 +138,63 @@ def get_bitrate(format_info):
         return 0
 
 
-def check_qs02_compatibility(format_info, video_info):
+def get_duration(format_info, video_info):
+    for info in (format_info, video_info):
+        try:
+            return max(0.0, float(info.get("duration", 0)))
+        except (ValueError, TypeError):
+            continue
+    return 0.0
+
+
+def peak_window(hdr):
+    if hdr:
+        return QS02_BUFSIZE_HDR / QS02_MAXRATE_HDR
+    return QS02_BUFSIZE_SDR / QS02_MAXRATE_SDR
+
+
+def scan_peak_bitrate(ffprobe, f, window_s):
+    # Streams packet sizes; only the packets of the current window are kept in memory
+    cmd = [
+        ffprobe, "-v", "error", "-show_entries", "packet=pts_time,dts_time,size", "-of", "compact=p=0", str(f),
+    ]
+    window = deque()
+    totals = {"window": 0, "peak": 0}
+
+    def on_line(line):
+        fields = dict(kv.split("=", 1) for kv in line.strip().split("|") if "=" in kv)
+        try:
+            size = int(fields.get("size", 0))
+            t = float(fields["dts_time"] if fields.get("dts_time", "N/A") != "N/A" else fields["pts_time"])
+        except (KeyError, ValueError):
+            return
+        window.append((t, size))
+        totals["window"] += size
+        while window[0][0] <= t - window_s:
+            totals["window"] -= window.popleft()[1]
+        totals["peak"] = max(totals["peak"], totals["window"])
+
+    result = run(cmd, timeout=PEAK_SCAN_TIMEOUT, on_line=on_line, pool="probe", capture_stderr=False)
+    if not result.ok:
+        return None
+    return int(totals["peak"] * 8 / window_s)
+
+
+def peak_bitrate(ffprobe, f, hdr, cache=None, st=None):
+    window_s = peak_window(hdr)
+    kind = f"peak_bitrate:{window_s:g}s"
+    peak = cache.get_analysis(f, kind, st) if cache else None
+    if cache:
+        METRICS.count("cache_pic_hit" if peak is not None else "cache_pic_miss")
+    if peak is None:
+        with METRICS.timer("pic_bitrate", st.st_size if st else 0):
+            peak = scan_peak_bitrate(ffprobe, f, window_s)
+        if peak is not None and cache:
+            cache.put_analysis(f, kind, peak, st)
+    return peak
+
+
+def check_qs02_compatibility(format_info, video_info, peak=None):
     issues = []
     is_compatible = True
 
@@ -104,6 +213,12 @@ def check_qs02_compatibility(format_info, video_info):
             f"Bitrate trop eleve: {bitrate // 1_000_000}M (max: {max_bitrate // 1_000_000}M pour {'HDR' if hdr else 'SDR'})"
         )
         is_compatible = False
+    if peak is not None and peak > max_bitrate:
+        issues.append(
+            f"Pic de bitrate trop eleve: {peak // 1_000_000}M sur {peak_window(hdr):g}s "
+            f"(max: {max_bitrate // 1_000_000}M pour {'HDR' if hdr else 'SDR'})"
+        )
+        is_compatible = False
 
     # Check pixel format
     pix_fmt = video_info.get("pix_fmt") or ""
@@ -119,8 +234,93 @@ def check_qs02_compatibility(format_info, video_info):
     return is_compatible, issues
 
 
-def analyze_file(ffprobe, filepath):
-    streams, format_info = probe(ffprobe, filepath)
+class FilmRecord:
+    # One inventory row; __slots__ + interned codec/TRC strings keep 50k+ catalogs compact
+    __slots__ = (
+        "path",
+        "hdr",
+        "trc",
+        "resolution",
+        "video_codec",
+        "bitrate",
+        "peak_bitrate",
+        "duration_s",
+        "audio_codecs",
+        "is_compatible",
+        "has_qs02_tag",
+        "issues",
+        "size",
+        "mtime_ns",
+    )
+
+    def __init__(
+        self,
+        path,
+        hdr,
+        trc,
+        resolution,
+        video_codec,
+        bitrate,
+        peak_bitrate,
+        duration_s,
+        audio_codecs,
+        is_compatible,
+        has_qs02_tag,
+        issues,
+        size,
+        mtime_ns,
+    ):
+        self.path = str(path)
+        self.hdr = bool(hdr)
+        self.trc = sys.intern(trc)
+        self.resolution = sys.intern(resolution)
+        self.video_codec = sys.intern(video_codec)
+        self.bitrate = int(bitrate)
+        self.peak_bitrate = int(peak_bitrate)
+        self.duration_s = float(duration_s)
+        self.audio_codecs = tuple(sys.intern(c) for c in audio_codecs)
+        self.is_compatible = bool(is_compatible)
+        self.has_qs02_tag = bool(has_qs02_tag)
+        self.issues = tuple(issues)
+        self.size = int(size)
+        self.mtime_ns = int(mtime_ns)
+
+    @property
+    def file(self):
+        return Path(self.path)
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def bitrate_mb(self):
+        return self.bitrate // 1_000_000 if self.bitrate > 0 else 0
+
+    @property
+    def audio_tracks(self):
+        return len(self.audio_codecs)
+
+    @property
+    def status(self):
+        return "OK" if self.is_compatible else "NON OK"
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != "path"}
+
+    @classmethod
+    def from_dict(cls, path, d):
+        return cls(path, **{slot: d[slot] for slot in cls.__slots__ if slot != "path"})
+
+
+def analyze_file(ffprobe, filepath, cache=None, st=None):
+    if st is None:
+        try:
+            st = filepath.stat()
+        except OSError:
+            return None, "Fichier inaccessible"
+
+    streams, format_info = probe(ffprobe, filepath, cache, st)
     if streams is None:
         return None, "Erreur lors de l'analyse ffprobe"
 
@@ -134,29 +334,360 @@ def analyze_file(ffprobe, filepath):
     resolution = f"{video_info.get('height', 0)}p"
     video_codec = video_info.get("codec_name", "unknown")
     bitrate = get_bitrate(format_info)
+    peak = peak_bitrate(ffprobe, filepath, hdr, cache, st) if DEEP_BITRATE_ANALYSIS else None
 
-    is_compatible, issues = check_qs02_compatibility(format_info, video_info)
+    is_compatible, issues = check_qs02_compatibility(format_info, video_info, peak)
 
     # Check naming (info only, not a compatibility criterion)
     has_qs02_tag = ".qs02" in filepath.stem.lower()
 
-    result = {
-        "file": filepath,
-        "hdr": hdr,
-        "trc": trc,
-        "resolution": resolution,
-        "video_codec": video_codec,
-        "bitrate_mb": bitrate // 1_000_000 if bitrate > 0 else 0,
-        "audio_tracks": len(audio_streams),
-        "audio_codecs": [a.get("codec_name", "unknown") for a in audio_streams],
-        "is_compatible": is_compatible,
-        "has_qs02_tag": has_qs02_tag,
-        "issues": issues,
-    }
+    result = FilmRecord(
+        filepath,
+        hdr,
+        trc,
+        resolution,
+        video_codec,
+        max(0, bitrate),
+        peak or 0,
+        get_duration(format_info, video_info),
+        [a.get("codec_name", "unknown") for a in audio_streams],
+        is_compatible,
+        has_qs02_tag,
+        issues,
+        st.st_size,
+        st.st_mtime_ns,
+    )
 
     return result, None
 
 
+def scan_video_files(root):
+    # Single os.scandir walk; DirEntry carries the stat info (free on Windows/SMB)
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda e: e.name.lower())
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in VIDEO_EXTS:
+                    yield entry
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+
+
+def is_unchanged(previous_result, st):
+    return (
+        previous_result is not None
+        and previous_result.size == st.st_size
+        and previous_result.mtime_ns == st.st_mtime_ns
+        and (previous_result.peak_bitrate > 0 or not DEEP_BITRATE_ANALYSIS)
+    )
+
+
+def analyze_entry(ffprobe, entry, cache=None, previous=None):
+    try:
+        st = entry.stat()
+    except OSError:
+        return None, "Fichier inaccessible"
+    if previous is not None:
+        previous_result = previous.get(entry.path)
+        if is_unchanged(previous_result, st):
+            METRICS.count("etat_reutilise")
+            return previous_result, None
+    with METRICS.timer("analyse", st.st_size):
+        return analyze_file(ffprobe, Path(entry.path), cache, st)
+
+
+def iter_analyzed(ffprobe, entries, cache=None, workers=PROBE_WORKERS, previous=None):
+    # Bounded in-flight window, results yielded in submission order
+    if workers <= 1:
+        for entry in entries:
+            yield Path(entry.path), *analyze_entry(ffprobe, entry, cache, previous)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool, kill_on_interrupt(pool):
+        pending = deque()
+        for entry in entries:
+            pending.append((Path(entry.path), pool.submit(analyze_entry, ffprobe, entry, cache, previous)))
+            if len(pending) >= workers * 2:
+                done_path, fut = pending.popleft()
+                yield done_path, *fut.result()
+        while pending:
+            done_path, fut = pending.popleft()
+            yield done_path, *fut.result()
+
+
+def load_state(state_file):
+    if not state_file.exists():
+        return {}
+    try:
+        data = json.loads(state_file.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        print(f"WARNING: etat precedent illisible, ignore: {state_file}")
+        return {}
+    state = {}
+    for path, r in data.get("files", {}).items():
+        try:
+            state[path] = FilmRecord.from_dict(path, r)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return state
+
+
+def save_state(state_file, results):
+    files = {r.path: r.to_dict() for r in results}
+    tmp = state_file.with_name(state_file.name + ".tmp")
+    tmp.write_text(json.dumps({"version": 1, "files": files}, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, state_file)
+
+
+def diff_inventory(previous, results, errors):
+    # Returns [(change, path, status_before, status_after)]
+    changes = []
+    current = {r.path: r for r in results}
+    for path, r in current.items():
+        before = previous.get(path)
+        if before is None:
+            changes.append(("AJOUTE", path, "", r.status))
+            continue
+        if before.size != r.size or before.mtime_ns != r.mtime_ns:
+            changes.append(("MODIFIE", path, before.status, r.status))
+        if before.is_compatible and not r.is_compatible:
+            changes.append(("NOUVEAU NON OK", path, before.status, r.status))
+        elif not before.is_compatible and r.is_compatible:
+            changes.append(("CORRIGE", path, before.status, r.status))
+    errored = {str(filepath) for filepath, _ in errors}
+    for path, before in previous.items():
+        if path in current:
+            continue
+        if path in errored:
+            changes.append(("ERREUR", path, before.status, "ERREUR"))
+        else:
+            changes.append(("SUPPRIME", path, before.status, ""))
+    return sorted(changes, key=lambda c: (c[0], c[1]))
+
+
+TSV_SAFE = str.maketrans({"\t": " ", "\n": " ", "\r": " "})
+
+EXPORT_COLUMNS = (
+    ("status", "TEXT"),
+    ("path", "TEXT"),
+    ("name", "TEXT"),
+    ("resolution", "TEXT"),
+    ("height", "INTEGER"),
+    ("hdr", "INTEGER"),
+    ("trc", "TEXT"),
+    ("video_codec", "TEXT"),
+    ("bitrate_mb", "INTEGER"),
+    ("bitrate", "INTEGER"),
+    ("peak_bitrate", "INTEGER"),
+    ("duration_s", "REAL"),
+    ("audio_tracks", "INTEGER"),
+    ("audio_codecs", "TEXT"),
+    ("is_compatible", "INTEGER"),
+    ("has_qs02_tag", "INTEGER"),
+    ("issues", "TEXT"),
+    ("size", "INTEGER"),
+    ("mtime_ns", "INTEGER"),
+)
+
+
+def record_row(r):
+    height = r.resolution[:-1]
+    return {
+        "status": r.status,
+        "path": r.path,
+        "name": r.name,
+        "resolution": r.resolution,
+        "height": int(height) if height.isdigit() else 0,
+        "hdr": r.hdr,
+        "trc": r.trc,
+        "video_codec": r.video_codec,
+        "bitrate_mb": r.bitrate_mb,
+        "bitrate": r.bitrate,
+        "peak_bitrate": r.peak_bitrate,
+        "duration_s": r.duration_s,
+        "audio_tracks": r.audio_tracks,
+        "audio_codecs": ", ".join(r.audio_codecs),
+        "is_compatible": r.is_compatible,
+        "has_qs02_tag": r.has_qs02_tag,
+        "issues": " | ".join(r.issues),
+        "size": r.size,
+        "mtime_ns": r.mtime_ns,
+    }
+
+
+class TsvExporter:
+    # Historical layout (OK rows first, then NON OK, each sorted by name): rows are kept until close()
+    suffix = ".tsv"
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+
+    def write(self, r):
+        self.records.append(r)
+
+    def close(self):
+        self.records.sort(key=lambda r: (not r.is_compatible, r.name))
+        with self.path.open("w", encoding="utf-8") as f:
+            f.write("Statut\tChemin\tResolution\tHDR\tTRC\tCodec\tBitrate_MB\tAudio_Pistes\tAudio_Codecs\tProblemes\n")
+            for r in self.records:
+                problemes = " | ".join(r.issues) if not r.is_compatible else ""
+                cols = (
+                    r.status,
+                    r.path,
+                    r.resolution,
+                    str(r.hdr),
+                    r.trc,
+                    r.video_codec,
+                    str(r.bitrate_mb),
+                    str(r.audio_tracks),
+                    ", ".join(r.audio_codecs),
+                    problemes,
+                )
+                f.write("\t".join(col.translate(TSV_SAFE) for col in cols) + "\n")
+
+    def abort(self):
+        self.records = []
+
+
+class JsonlExporter:
+    # Streamed into a .tmp file and swapped in at close(): an interrupted scan keeps the previous inventory
+    suffix = ".jsonl"
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = path.with_name(path.name + ".tmp")
+        self.f = self.tmp.open("w", encoding="utf-8")
+
+    def write(self, r):
+        self.f.write(json.dumps(record_row(r), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.f.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self.f.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+# Indexed columns of the SQLite store, used by the "query" subcommand. Each index also carries the
+# other filter columns and the totals (size, duration) so filtered aggregates never touch the table.
+SQLITE_INDEXES = ("video_codec", "hdr", "bitrate", "height", "is_compatible")
+SQLITE_INDEX_COVER = SQLITE_INDEXES + ("size", "duration_s")
+
+
+class SqliteExporter:
+    # Built in a .tmp file and swapped in at close(): queries keep the previous inventory meanwhile
+    suffix = ".sqlite"
+    batch_size = 500
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = path.with_name(path.name + ".tmp")
+        self.tmp.unlink(missing_ok=True)
+        self.conn = sqlite3.connect(str(self.tmp))
+        self.conn.execute(
+            f"CREATE TABLE films (id INTEGER PRIMARY KEY, "
+            f"{', '.join(f'{name} {kind}' for name, kind in EXPORT_COLUMNS)}, UNIQUE (path))"
+        )
+        # One row per audio track: "DTS only" style questions become indexed lookups
+        self.conn.execute("CREATE TABLE film_audio (film_id INTEGER NOT NULL, track INTEGER NOT NULL, codec TEXT NOT NULL)")
+        self.insert = (
+            f"INSERT INTO films (id, {', '.join(name for name, _ in EXPORT_COLUMNS)}) "
+            f"VALUES (?, {', '.join('?' for _ in EXPORT_COLUMNS)})"
+        )
+        self.next_id = 1
+        self.pending = []
+        self.pending_audio = []
+
+    def write(self, r):
+        row = record_row(r)
+        self.pending.append((self.next_id, *(row[name] for name, _ in EXPORT_COLUMNS)))
+        self.pending_audio.extend((self.next_id, i, codec) for i, codec in enumerate(r.audio_codecs))
+        self.next_id += 1
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.conn.executemany(self.insert, self.pending)
+        self.conn.executemany("INSERT INTO film_audio (film_id, track, codec) VALUES (?, ?, ?)", self.pending_audio)
+        self.conn.commit()
+        self.pending = []
+        self.pending_audio = []
+
+    def close(self):
+        self.flush()
+        # Indexes built once after the bulk load
+        for column in SQLITE_INDEXES:
+            covered = [column] + [c for c in SQLITE_INDEX_COVER if c != column]
+            self.conn.execute(f"CREATE INDEX idx_films_{column} ON films ({', '.join(covered)})")
+        self.conn.execute("CREATE INDEX idx_film_audio_codec ON film_audio (codec, film_id)")
+        self.conn.execute("CREATE INDEX idx_film_audio_film ON film_audio (film_id)")
+        self.conn.execute("ANALYZE")
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self.conn.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+class ParquetExporter:
+    # Columnar format: buffered in memory and written in one go at close()
+    suffix = ".parquet"
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = {name: [] for name, _ in EXPORT_COLUMNS}
+
+    def write(self, r):
+        for name, value in record_row(r).items():
+            self.columns[name].append(value)
+
+    def close(self):
+        types = {"TEXT": pa.string(), "INTEGER": pa.int64(), "REAL": pa.float64()}
+        schema = pa.schema(
+            [(name, pa.bool_() if name in {"hdr", "is_compatible", "has_qs02_tag"} else types[kind]) for name, kind in EXPORT_COLUMNS]
+        )
+        pq.write_table(pa.table(self.columns, schema=schema), str(self.path))
+
+    def abort(self):
+        self.columns = {}
+
+
+EXPORTERS = {
+    "tsv": TsvExporter,
+    "jsonl": JsonlExporter,
+    "sqlite": SqliteExporter,
+    "parquet": ParquetExporter,
+}
+
+
+def open_exporters(formats, basename):
+    exporters = []
+    for fmt in formats:
+        cls = EXPORTERS.get(fmt)
+        if cls is None:
+            print(f"WARNING: format d'export inconnu ignore: {fmt}")
+            continue
+        if cls is ParquetExporter and pa is None:
+            print("WARNING: export parquet ignore (pyarrow non installe)")
+            continue
+        exporters.append(cls(basename.with_name(basename.name + cls.suffix)))
+    return exporters
+
+
 def format_size(size_bytes):
     for unit in ["B", "KB", "MB", "GB", "TB"]:
         if size_bytes < 1024.0:
@@ -170,45 +701,77 @@ def main():
         raise SystemExit(f"ERROR: Repertoire introuvable: {FILMS_DIR}")
 
     ffprobe = need("ffprobe")
+    cache = open_cache(PROBE_CACHE_FILE)
+    previous = load_state(STATE_FILE)
+    if INCREMENTAL:
+        print(f"Mode incremental: {len(previous)} fichier(s) connus dans {STATE_FILE}")
 
     print(f"Analyse de {FILMS_DIR}...")
     print("=" * 80)
 
-    compatible_files = []
-    needs_normalization = []
+    results = []
     errors = []
+    exporters = open_exporters(EXPORT_FORMATS, INVENTORY_BASENAME)
 
-    # Recursive scan
-    video_files = []
-    for ext in VIDEO_EXTS:
-        video_files.extend(FILMS_DIR.rglob(f"*{ext}"))
-        video_files.extend(FILMS_DIR.rglob(f"*{ext.upper()}"))
+    # Recursive scan, streamed into the probe pool as files are discovered: the total is only known
+    # once the walk ends, progress lines read [i] until then and [i/total] afterwards
+    seen = set()
+    walked = False
+    total = None
 
-    # Deduplicate (Windows is case-insensitive)
-    video_files = list(dict.fromkeys(video_files))
+    def discovered():
+        nonlocal walked
+        for entry in scan_video_files(FILMS_DIR.resolve()):
+            seen.add(entry.path)
+            yield entry
+        walked = True
 
-    total = len(video_files)
-    print(f"Fichiers video trouves: {total}\n")
-
-    for i, filepath in enumerate(video_files, 1):
-        print(f"[{i}/{total}] {filepath.name}...", end=" ", flush=True)
-        result, error = analyze_file(ffprobe, filepath)
-        if error:
-            errors.append((filepath, error))
-            print(f"ERREUR: {error}")
-        else:
-            if result["is_compatible"]:
-                compatible_files.append(result)
-                print("OK (compatible QS02)")
+    try:
+        analyzed = iter_analyzed(ffprobe, discovered(), cache, previous=previous if INCREMENTAL else None)
+        for i, (filepath, result, error) in enumerate(analyzed, 1):
+            if total is None and walked:
+                total = len(seen)
+                print(f"Fichiers video trouves: {total}\n")
+            print(f"[{i}/{total}] {filepath.name}..." if total is not None else f"[{i}] {filepath.name}...", end=" ", flush=True)
+            if error:
+                errors.append((filepath, error))
+                print(f"ERREUR: {error}")
             else:
-                needs_normalization.append(result)
-                print("NORMALISATION REQUISE")
+                results.append(result)
+                for exporter in exporters:
+                    exporter.write(result)
+                print("OK (compatible QS02)" if result.is_compatible else "NORMALISATION REQUISE")
+        if total is None:
+            print(f"Fichiers video trouves: {len(seen)}")
+
+        with METRICS.timer("export"):
+            for exporter in exporters:
+                exporter.close()
+    except BaseException:
+        # Ctrl+C or a failed scan/export: no open handle, no stray .tmp, previous inventory kept
+        for exporter in exporters:
+            exporter.abort()
+        raise
+
+    if cache:
+        pruned = cache.prune(FILMS_DIR, seen)
+        if pruned:
+            print(f"\nCache ffprobe: {pruned} entree(s) obsolete(s) supprimee(s)")
+        cache.close()
+
+    save_state(STATE_FILE, results)
+    changes = diff_inventory(previous, results, errors) if previous else []
+
+    # Sort once by name; the per-status views below keep that order
+    results.sort(key=lambda r: r.name)
+    compatible_files = [r for r in results if r.is_compatible]
+    needs_normalization = [r for r in results if not r.is_compatible]
 
     # Summary report
     print("\n" + "=" * 80)
     print("RESUME")
     print("=" * 80)
-    print(f"\nTotal fichiers: {total}")
+    print(f"\nTotal fichiers: {len(seen)}")
     print(f"Compatible QS02: {len(compatible_files)}")
     print(f"Normalisation requise: {len(needs_normalization)}")
     print(f"Erreurs: {len(errors)}")
@@ -218,14 +781,16 @@ def main():
     print("FICHIERS COMPATIBLES QS02")
     print("=" * 80)
     if compatible_files:
-        for r in sorted(compatible_files, key=lambda x: x["file"].name):
-            print(f"\n{r['file'].name}")
-            print(f"  Chemin: {r['file']}")
-            print(f"  Resolution: {r['resolution']}")
-            print(f"  HDR: {r['hdr']} ({r['trc']})")
-            print(f"  Codec: {r['video_codec']}")
-            print(f"  Bitrate: {r['bitrate_mb']}M")
-            print(f"  Audio: {r['audio_tracks']} pistes ({', '.join(r['audio_codecs'])})")
+        for r in compatible_files:
+            print(f"\n{r.name}")
+            print(f"  Chemin: {r.path}")
+            print(f"  Resolution: {r.resolution}")
+            print(f"  HDR: {r.hdr} ({r.trc})")
+            print(f"  Codec: {r.video_codec}")
+            print(f"  Bitrate: {r.bitrate_mb}M")
+            if r.peak_bitrate:
+                print(f"  Pic bitrate: {r.peak_bitrate // 1_000_000}M")
+            print(f"  Audio: {r.audio_tracks} pistes ({', '.join(r.audio_codecs)})")
     else:
         print("Aucun fichier compatible trouve.")
 
@@ -233,17 +798,19 @@ def main():
     print("FICHIERS REQUERANT NORMALISATION")
     print("=" * 80)
     if needs_normalization:
-        for r in sorted(needs_normalization, key=lambda x: x["file"].name):
-            print(f"\n{r['file'].name}")
-            print(f"  Chemin: {r['file']}")
-            print(f"  Resolution: {r['resolution']}")
-            print(f"  HDR: {r['hdr']} ({r['trc']})")
-            print(f"  Codec: {r['video_codec']}")
-            print(f"  Bitrate: {r['bitrate_mb']}M")
-            print(f"  Audio: {r['audio_tracks']} pistes ({', '.join(r['audio_codecs'])})")
-            if r["issues"]:
+        for r in needs_normalization:
+            print(f"\n{r.name}")
+            print(f"  Chemin: {r.path}")
+            print(f"  Resolution: {r.resolution}")
+            print(f"  HDR: {r.hdr} ({r.trc})")
+            print(f"  Codec: {r.video_codec}")
+            print(f"  Bitrate: {r.bitrate_mb}M")
+            if r.peak_bitrate:
+                print(f"  Pic bitrate: {r.peak_bitrate // 1_000_000}M")
+            print(f"  Audio: {r.audio_tracks} pistes ({', '.join(r.audio_codecs)})")
+            if r.issues:
                 print(f"  Problemes:")
-                for issue in r["issues"]:
+                for issue in r.issues:
                     print(f"    - {issue}")
     else:
         print("Aucun fichier necessitant normalisation.")
@@ -255,49 +822,184 @@ def main():
         for filepath, error in errors:
             print(f"{filepath.name}: {error}")
 
-    # Write TSV file
-    output_dir = Path(".")
-    tsv_file = output_dir / "films_qs02_inventaire.tsv"
-
-    with tsv_file.open("w", encoding="utf-8") as f:
-        # Header
-        f.write("Statut\tChemin\tResolution\tHDR\tTRC\tCodec\tBitrate_MB\tAudio_Pistes\tAudio_Codecs\tProblemes\n")
-
-        # Write compatible files first
-        for r in sorted(compatible_files, key=lambda x: x["file"].name):
-            chemin = str(r["file"]).replace("\t", " ").replace("\n", " ")
-            resolution = str(r["resolution"]).replace("\t", " ").replace("\n", " ")
-            hdr = str(r["hdr"]).replace("\t", " ").replace("\n", " ")
-            trc = str(r["trc"]).replace("\t", " ").replace("\n", " ")
-            codec = str(r["video_codec"]).replace("\t", " ").replace("\n", " ")
-            bitrate = str(r["bitrate_mb"]).replace("\t", " ").replace("\n", " ")
-            audio_tracks = str(r["audio_tracks"]).replace("\t", " ").replace("\n", " ")
-            audio_codecs = ", ".join(r["audio_codecs"]).replace("\t", " ").replace("\n", " ")
-            problemes = ""
-            f.write(
-                f"OK\t{chemin}\t{resolution}\t{hdr}\t{trc}\t{codec}\t{bitrate}\t{audio_tracks}\t{audio_codecs}\t{problemes}\n"
-            )
-
-        # Write files needing normalization
-        for r in sorted(needs_normalization, key=lambda x: x["file"].name):
-            chemin = str(r["file"]).replace("\t", " ").replace("\n", " ")
-            resolution = str(r["resolution"]).replace("\t", " ").replace("\n", " ")
-            hdr = str(r["hdr"]).replace("\t", " ").replace("\n", " ")
-            trc = str(r["trc"]).replace("\t", " ").replace("\n", " ")
-            codec = str(r["video_codec"]).replace("\t", " ").replace("\n", " ")
-            bitrate = str(r["bitrate_mb"]).replace("\t", " ").replace("\n", " ")
-            audio_tracks = str(r["audio_tracks"]).replace("\t", " ").replace("\n", " ")
-            audio_codecs = ", ".join(r["audio_codecs"]).replace("\t", " ").replace("\n", " ")
-            problemes = " | ".join(r["issues"]).replace("\t", " ").replace("\n", " ")
-            f.write(
-                f"NON OK\t{chemin}\t{resolution}\t{hdr}\t{trc}\t{codec}\t{bitrate}\t{audio_tracks}\t{audio_codecs}\t{problemes}\n"
-            )
+    if previous:
+        print("\n" + "=" * 80)
+        print("CHANGEMENTS DEPUIS LE DERNIER INVENTAIRE")
+        print("=" * 80)
+        if changes:
+            for change, path, before, after in changes:
+                print(f"{change}: {Path(path).name} ({before or '-'} -> {after or '-'})")
+        else:
+            print("Aucun changement.")
+        with CHANGES_FILE.open("w", encoding="utf-8") as f:
+            f.write("Changement\tChemin\tStatut_Avant\tStatut_Apres\n")
+            for change, path, before, after in changes:
+                chemin = path.replace("\t", " ").replace("\n", " ")
+                f.write(f"{change}\t{chemin}\t{before}\t{after}\n")
 
     print(f"\n" + "=" * 80)
     print("FICHIER GENERE")
     print("=" * 80)
-    print(f"Inventaire TSV: {tsv_file}")
+    for exporter in exporters:
+        print(f"Inventaire {exporter.suffix[1:].upper()}: {exporter.path}")
+    print(f"Etat: {STATE_FILE}")
+    if previous:
+        print(f"Changements: {CHANGES_FILE}")
+
+    METRICS.print_summary()
+    if METRICS_FILE:
+        METRICS.write(METRICS_FILE)
+        print(f"Metriques: {METRICS_FILE}")
+
+
+QUERY_GROUPS = {
+    "status": "CASE films.is_compatible WHEN 1 THEN 'OK' ELSE 'NON OK' END",
+    "codec": "films.video_codec",
+    "hdr": "CASE films.hdr WHEN 1 THEN 'HDR' ELSE 'SDR' END",
+    "trc": "films.trc",
+    "resolution": "films.resolution",
+    "audio": "film_audio.codec",
+    "dossier": "films.path",
+}
+
+QUERY_ORDERS = {
+    "nom": "films.name",
+    "bitrate": "films.bitrate DESC",
+    "taille": "films.size DESC",
+    "duree": "films.duration_s DESC",
+}
+
+
+def query_parser():
+    parser = argparse.ArgumentParser(
+        prog="QS02_inventaire.py query",
+        description="Interroge l'inventaire SQLite (aucune re-analyse des fichiers).",
+    )
+    parser.add_argument("--db", type=Path, default=INVENTORY_BASENAME.with_name(INVENTORY_BASENAME.name + ".sqlite"))
+    parser.add_argument("--statut", choices=("ok", "non-ok"), help="OK ou NON OK")
+    parser.add_argument("--codec", action="append", default=[], help="codec video (repetable)")
+    dyn = parser.add_mutually_exclusive_group()
+    dyn.add_argument("--hdr", action="store_true", help="uniquement HDR")
+    dyn.add_argument("--sdr", action="store_true", help="uniquement SDR")
+    parser.add_argument("--trc", action="append", default=[], help="transfert couleur (repetable)")
+    parser.add_argument("--min-bitrate", type=float, help="bitrate moyen minimum (Mbps, inclus)")
+    parser.add_argument("--max-bitrate", type=float, help="bitrate moyen maximum (Mbps, inclus)")
+    parser.add_argument("--min-peak", type=float, help="pic de bitrate minimum (Mbps, DEEP_BITRATE_ANALYSIS)")
+    parser.add_argument("--min-height", type=int, help="hauteur minimum (ex: 2160)")
+    parser.add_argument("--max-height", type=int, help="hauteur maximum")
+    parser.add_argument("--audio", action="append", default=[], help="au moins une piste audio de ce codec (repetable)")
+    parser.add_argument("--sans-audio", action="append", default=[], help="aucune piste audio de ce codec (repetable)")
+    parser.add_argument("--sans-audio-qs02", action="store_true", help="aucune piste audio AC3/AAC")
+    parser.add_argument("--nom", help="sous-chaine du chemin (insensible a la casse)")
+    parser.add_argument("--group-by", choices=sorted(QUERY_GROUPS), help="agregation par colonne")
+    parser.add_argument("--tri", choices=sorted(QUERY_ORDERS), default="nom")
+    parser.add_argument("--limit", type=int, default=50, help="lignes affichees (0 = toutes)")
+    return parser
+
+
+def query_filters(args):
+    where = []
+    params = []
+    if args.statut:
+        where.append("films.is_compatible = ?")
+        params.append(1 if args.statut == "ok" else 0)
+    if args.codec:
+        where.append(f"films.video_codec IN ({', '.join('?' for _ in args.codec)})")
+        params.extend(c.lower() for c in args.codec)
+    if args.hdr or args.sdr:
+        where.append("films.hdr = ?")
+        params.append(1 if args.hdr else 0)
+    if args.trc:
+        where.append(f"films.trc IN ({', '.join('?' for _ in args.trc)})")
+        params.extend(args.trc)
+    if args.min_bitrate is not None:
+        where.append("films.bitrate >= ?")
+        params.append(int(args.min_bitrate * 1_000_000))
+    if args.max_bitrate is not None:
+        where.append("films.bitrate <= ?")
+        params.append(int(args.max_bitrate * 1_000_000))
+    if args.min_peak is not None:
+        where.append("films.peak_bitrate >= ?")
+        params.append(int(args.min_peak * 1_000_000))
+    if args.min_height is not None:
+        where.append("films.height >= ?")
+        params.append(args.min_height)
+    if args.max_height is not None:
+        where.append("films.height <= ?")
+        params.append(args.max_height)
+    for codec in args.audio:
+        where.append("films.id IN (SELECT film_id FROM film_audio WHERE codec = ?)")
+        params.append(codec.lower())
+    excluded = [c.lower() for c in args.sans_audio]
+    if args.sans_audio_qs02:
+        excluded.extend(sorted(QS02_AUDIO_CODECS))
+    if excluded:
+        where.append(
+            f"films.id NOT IN (SELECT film_id FROM film_audio WHERE codec IN ({', '.join('?' for _ in excluded)}))"
+        )
+        params.extend(excluded)
+    if args.nom:
+        where.append("films.path LIKE ? ESCAPE '\\'")
+        params.append("%" + args.nom.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    return (" WHERE " + " AND ".join(where)) if where else "", params
+
+
+def format_runtime(seconds):
+    minutes = int(seconds // 60)
+    return f"{minutes // 60}h{minutes % 60:02d}"
+
+
+def query_main(argv):
+    args = query_parser().parse_args(argv)
+    if not args.db.exists():
+        raise SystemExit(f"ERROR: inventaire SQLite introuvable: {args.db} (ajouter \"sqlite\" a EXPORT_FORMATS)")
+    conn = sqlite3.connect(f"{args.db.resolve().as_uri()}?mode=ro", uri=True)
+    t0 = time.perf_counter()
+    where, params = query_filters(args)
+    limit = f" LIMIT {int(args.limit)}" if args.limit > 0 else ""
+    totals = conn.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(films.size), 0), COALESCE(SUM(films.duration_s), 0) FROM films{where}", params
+    ).fetchone()
+
+    if args.group_by:
+        key = QUERY_GROUPS[args.group_by]
+        source = "films"
+        if args.group_by == "audio":
+            source = "films JOIN (SELECT DISTINCT film_id, codec FROM film_audio) film_audio ON film_audio.film_id = films.id"
+        elif args.group_by == "dossier":
+            key = "rtrim(films.path, replace(films.path, ?, ''))"
+            params = [os.sep] + params
+        rows = conn.execute(
+            f"SELECT {key} AS groupe, COUNT(*), SUM(films.size), SUM(films.duration_s) FROM {source}{where} "
+            f"GROUP BY groupe ORDER BY COUNT(*) DESC, groupe{limit}",
+            params,
+        ).fetchall()
+        print(f"{args.group_by.capitalize():<40}{'Films':>8}{'Taille(GB)':>12}{'Duree':>10}")
+        for groupe, count, size, duration in rows:
+            print(f"{str(groupe):<40}{count:>8}{size / 1e9:>12.1f}{format_runtime(duration or 0):>10}")
+    else:
+        rows = conn.execute(
+            f"SELECT films.status, films.name, films.resolution, films.hdr, films.video_codec, films.bitrate, "
+            f"films.size, films.duration_s, films.audio_codecs FROM films{where} ORDER BY {QUERY_ORDERS[args.tri]}{limit}",
+            params,
+        ).fetchall()
+        for status, name, resolution, hdr, codec, bitrate, size, duration, audio in rows:
+            print(
+                f"{status:<7}{resolution:>6} {'HDR' if hdr else 'SDR'} {codec:<6}{bitrate / 1e6:>6.1f}M"
+                f"{size / 1e9:>7.1f}GB{format_runtime(duration):>7}  {audio:<16} {name}"
+            )
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    conn.close()
+
+    count, size, duration = totals
+    print("-" * 80)
+    print(f"Total: {count} film(s), {size / 1e9:.1f} GB, {format_runtime(duration)} ({elapsed_ms:.1f} ms)")
+    if args.limit > 0 and len(rows) >= args.limit:
+        print(f"(affichage limite a {args.limit} lignes, --limit 0 pour tout afficher)")
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["query"]:
+        query_main(sys.argv[2:])
+    else:
+        main()
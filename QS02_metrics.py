@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Instrumentation legere partagee par QS02_inventaire et QS02_vid_normaliser.
+
+- METRICS.timer("etape", nbytes) : chronometre un bloc (context manager), thread-safe.
+- METRICS.count("compteur") : compteurs simples (ex: hits/miss du cache ffprobe).
+- METRICS.print_summary() / METRICS.write(path) : resume de fin de run (console, JSON ou CSV).
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+import csv
+import json
+import math
+import threading
+import time
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    # Nearest-rank percentile on an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.timings: dict[str, list[float]] = {}
+        self.bytes: dict[str, int] = {}
+        self.counters: dict[str, int] = {}
+
+    @contextmanager
+    def timer(self, stage: str, nbytes: int = 0) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - t0, nbytes)
+
+    def record(self, stage: str, seconds: float, nbytes: int = 0) -> None:
+        with self._lock:
+            self.timings.setdefault(stage, []).append(seconds)
+            self.bytes[stage] = self.bytes.get(stage, 0) + int(nbytes or 0)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def rows(self) -> list[dict]:
+        with self._lock:
+            timings = {stage: sorted(values) for stage, values in self.timings.items()}
+            nbytes = dict(self.bytes)
+        rows = []
+        for stage, values in timings.items():
+            total = sum(values)
+            stage_bytes = nbytes.get(stage, 0)
+            rows.append(
+                {
+                    "stage": stage,
+                    "count": len(values),
+                    "total_s": round(total, 4),
+                    "mean_s": round(total / len(values), 4),
+                    "p50_s": round(percentile(values, 50), 4),
+                    "p95_s": round(percentile(values, 95), 4),
+                    "max_s": round(values[-1], 4),
+                    "bytes": stage_bytes,
+                    "mb_per_s": round(stage_bytes / total / 1_000_000, 2) if total > 0 and stage_bytes else None,
+                }
+            )
+        return rows
+
+    def print_summary(self) -> None:
+        rows = self.rows()
+        wall = time.perf_counter() - self.started
+        print("\n" + "=" * 80)
+        print("METRIQUES")
+        print("=" * 80)
+        print(f"Duree totale: {wall:.1f}s")
+        if rows:
+            print(f"{'Etape':<16}{'N':>7}{'Total(s)':>11}{'Moy(s)':>9}{'P50(s)':>9}{'P95(s)':>9}{'Max(s)':>9}{'MB/s':>9}")
+            for r in rows:
+                mbps = f"{r['mb_per_s']:.1f}" if r["mb_per_s"] is not None else "-"
+                print(
+                    f"{r['stage']:<16}{r['count']:>7}{r['total_s']:>11.2f}{r['mean_s']:>9.3f}"
+                    f"{r['p50_s']:>9.3f}{r['p95_s']:>9.3f}{r['max_s']:>9.3f}{mbps:>9}"
+                )
+        for name, value in sorted(self.counters.items()):
+            print(f"{name}: {value}")
+
+    def write(self, path: Path) -> None:
+        path = Path(path)
+        rows = self.rows()
+        if path.suffix.lower() == ".csv":
+            with path.open("w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(
+                    f, fieldnames=["stage", "count", "total_s", "mean_s", "p50_s", "p95_s", "max_s", "bytes", "mb_per_s"]
+                )
+                writer.writeheader()
+                writer.writerows(rows)
+                for name, value in sorted(self.counters.items()):
+                    writer.writerow({"stage": name, "count": value})
+            return
+        data = {
+            "wall_s": round(time.perf_counter() - self.started, 3),
+            "stages": rows,
+            "counters": dict(sorted(self.counters.items())),
+        }
+        path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+METRICS = Metrics()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Cache persistant des resultats ffprobe (SQLite), partage par QS02_inventaire et QS02_vid_normaliser.
+
+Cle: chemin resolu + taille + mtime. Une entree dont la taille ou le mtime ne correspond plus
+est consideree invalide et sera ecrasee au prochain probe.
+
+La table "analysis" garde, avec la meme cle, les resultats d'analyses couteuses (ex: pic de bitrate
+par paquets), identifies par un nom d'analyse incluant ses parametres.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probe (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analysis (
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (path, kind)
+);
+"""
+
+CACHE_TABLES = ("probe", "analysis")
+
+
+def file_key(f: Path, st: os.stat_result | None = None) -> tuple[str, int, int]:
+    if st is None:
+        st = os.stat(f)
+    return str(Path(f).resolve()), st.st_size, st.st_mtime_ns
+
+
+class ProbeCache:
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def get(self, f: Path, st: os.stat_result | None = None) -> dict | None:
+        try:
+            path, size, mtime_ns = file_key(f, st)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, data FROM probe WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None
+        try:
+            return json.loads(row[2])
+        except json.JSONDecodeError:
+            return None
+
+    def put(self, f: Path, data: dict, st: os.stat_result | None = None) -> None:
+        try:
+            path, size, mtime_ns = file_key(f, st)
+        except OSError:
+            return
+        payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO probe (path, size, mtime_ns, data) VALUES (?, ?, ?, ?)",
+                (path, size, mtime_ns, payload),
+            )
+            self._conn.commit()
+
+    def get_analysis(self, f: Path, kind: str, st: os.stat_result | None = None):
+        try:
+            path, size, mtime_ns = file_key(f, st)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, data FROM analysis WHERE path = ? AND kind = ?", (path, kind)
+            ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None
+        try:
+            return json.loads(row[2])
+        except json.JSONDecodeError:
+            return None
+
+    def put_analysis(self, f: Path, kind: str, data, st: os.stat_result | None = None) -> None:
+        try:
+            path, size, mtime_ns = file_key(f, st)
+        except OSError:
+            return
+        payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis (path, kind, size, mtime_ns, data) VALUES (?, ?, ?, ?, ?)",
+                (path, kind, size, mtime_ns, payload),
+            )
+            self._conn.commit()
+
+    def _delete_paths(self, keep) -> int:
+        stale = set()
+        for table in CACHE_TABLES:
+            rows = self._conn.execute(f"SELECT DISTINCT path FROM {table}").fetchall()
+            stale.update(p for (p,) in rows if not keep(p))
+        for table in CACHE_TABLES:
+            self._conn.executemany(f"DELETE FROM {table} WHERE path = ?", [(p,) for p in stale])
+        self._conn.commit()
+        return len(stale)
+
+    def prune(self, root: Path, seen: set[str]) -> int:
+        # Drop entries under root that were not seen during the last scan (deleted/moved files)
+        prefix = str(Path(root).resolve()).rstrip("\\/") + os.sep
+        with self._lock:
+            return self._delete_paths(lambda p: not p.startswith(prefix) or p in seen)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_cache(db_path: Path | None) -> ProbeCache | None:
+    if db_path is None:
+        return None
+    try:
+        return ProbeCache(db_path)
+    except sqlite3.Error as e:
+        print(f"WARNING: cache ffprobe indisponible ({db_path}): {e}")
+        return None
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Execution des sous-processus (ffprobe, ffmpeg) sur une boucle asyncio partagee par QS02_inventaire
+et QS02_vid_normaliser. Les scripts restent synchrones: run() bloque le thread appelant.
+
+- timeout par commande: le processus est tue, le resultat porte timed_out=True.
+- Concurrence bornee par groupe de commandes (POOL_LIMITS: "probe", "encode", ...).
+- stdout lu au fil de l'eau (une fonction appelee par ligne, dans le thread appelant) ou capture en bytes.
+- Ctrl+C ou fin du programme: les processus encore vivants sont tues (shutdown()). interrupt() fait
+  de meme sans fermer le runner (ex: bail perdu dans QS02_farm), resume() accepte a nouveau des commandes.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Callable, Iterator
+from concurrent.futures import Executor
+from contextlib import contextmanager
+import asyncio
+import atexit
+import queue
+import threading
+
+# Processus simultanes par groupe; les groupes absents utilisent DEFAULT_LIMIT
+POOL_LIMITS = {"probe": 16, "encode": 8}
+DEFAULT_LIMIT = 8
+
+# Lecture stdout en lecture ligne par ligne: taille des blocs lus, et blocs en attente par processus
+# avant de suspendre la lecture (le processus attend alors que le thread appelant rattrape)
+STREAM_CHUNK = 1 << 16
+STREAM_BACKLOG = 64
+
+# Attente maximale (s) de la fin d'un processus tue
+KILL_WAIT = 5
+
+
+class RunInterrupted(RuntimeError):
+    # Command refused or killed by interrupt() / shutdown(): not a failure of the command itself
+    pass
+
+
+class RunResult:
+    __slots__ = ("returncode", "stdout", "stderr", "timed_out")
+
+    def __init__(self, returncode: int | None, stdout: bytes, stderr: bytes, timed_out: bool = False) -> None:
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+    def text(self) -> tuple[str, str]:
+        return self.stdout.decode("utf-8", errors="replace"), self.stderr.decode("utf-8", errors="replace")
+
+
+class ProcessRunner:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._procs: set[asyncio.subprocess.Process] = set()
+        self._killed: set[asyncio.subprocess.Process] = set()
+        self._limits: dict[str, asyncio.Semaphore] = {}
+        self.closed = False
+        self.interrupted = False
+
+    def _check(self) -> None:
+        if self.closed or self.interrupted:
+            raise RunInterrupted("execution des processus interrompue")
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            self._check()
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="qs02-runner", daemon=True).start()
+            return self._loop
+
+    def _limit(self, pool: str) -> asyncio.Semaphore:
+        # Only touched from the loop thread
+        sem = self._limits.get(pool)
+        if sem is None:
+            sem = self._limits[pool] = asyncio.Semaphore(POOL_LIMITS.get(pool, DEFAULT_LIMIT))
+        return sem
+
+    async def _communicate(self, proc: asyncio.subprocess.Process, chunks: queue.Queue | None) -> tuple[bytes, bytes]:
+        err_task = asyncio.ensure_future(proc.stderr.read()) if proc.stderr else None
+        out = b""
+        if chunks is None:
+            out = await proc.stdout.read()
+        else:
+            # The loop thread only moves raw blocks: line parsing happens in the calling thread
+            while chunk := await proc.stdout.read(STREAM_CHUNK):
+                while True:
+                    try:
+                        chunks.put_nowait(chunk)
+                        break
+                    except queue.Full:
+                        await asyncio.sleep(0.01)
+        err = await err_task if err_task else b""
+        await proc.wait()
+        return out, err
+
+    async def _run(
+        self,
+        cmd: list[str],
+        timeout: float | None,
+        chunks: queue.Queue | None,
+        pool: str,
+        capture_stderr: bool,
+    ) -> RunResult:
+        async with self._limit(pool):
+            self._check()
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE if capture_stderr else None,
+            )
+            self._procs.add(proc)
+            try:
+                out, err = await asyncio.wait_for(self._communicate(proc, chunks), timeout)
+                result = RunResult(proc.returncode, out, err)
+            except asyncio.TimeoutError:
+                result = RunResult(None, b"", f"timeout apres {timeout:g}s".encode(), timed_out=True)
+            finally:
+                # Timeout, cancellation or a failing line handler: never leave the process behind
+                if proc.returncode is None:
+                    try:
+                        proc.kill()
+                    except ProcessLookupError:
+                        pass
+                    # Bounded: a process stuck on an unreachable share may not die right away
+                    try:
+                        await asyncio.wait_for(proc.wait(), KILL_WAIT)
+                    except asyncio.TimeoutError:
+                        pass
+                self._procs.discard(proc)
+            if proc in self._killed:
+                self._killed.discard(proc)
+                raise RunInterrupted(f"processus tue (interruption): {cmd[0]}")
+            return result
+
+    def _feed(self, chunks: queue.Queue, future, on_line: Callable[[str], None]) -> None:
+        pending = b""
+        while True:
+            try:
+                chunk = chunks.get(timeout=0.1)
+            except queue.Empty:
+                # Everything queued before the end of the task has been read
+                if future.done() and chunks.empty():
+                    break
+                continue
+            *lines, pending = (pending + chunk).split(b"\n")
+            for raw in lines:
+                on_line(raw.decode("utf-8", errors="replace"))
+        if pending:
+            on_line(pending.decode("utf-8", errors="replace"))
+
+    def run(
+        self,
+        cmd: list[str],
+        timeout: float | None = None,
+        on_line: Callable[[str], None] | None = None,
+        pool: str = "tool",
+        capture_stderr: bool = True,
+    ) -> RunResult:
+        # on_line runs in the calling thread: concurrent line handlers stay parallel
+        loop = self._ensure_loop()
+        chunks = queue.Queue(maxsize=STREAM_BACKLOG) if on_line else None
+        future = asyncio.run_coroutine_threadsafe(self._run(cmd, timeout, chunks, pool, capture_stderr), loop)
+        try:
+            if chunks is not None:
+                self._feed(chunks, future, on_line)
+            return future.result()
+        except BaseException:
+            # Ctrl+C or a failing line handler: cancelling the task kills the process
+            future.cancel()
+            raise
+
+    def _kill_all(self) -> None:
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return
+
+        async def kill_all() -> None:
+            for proc in list(self._procs):
+                self._killed.add(proc)
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+
+        try:
+            asyncio.run_coroutine_threadsafe(kill_all(), loop).result(timeout=5)
+        except Exception:
+            pass
+
+    def interrupt(self) -> None:
+        # Kill the running commands and refuse new ones until resume(); callers get RunInterrupted
+        with self._lock:
+            self.interrupted = True
+        self._kill_all()
+
+    def resume(self) -> None:
+        with self._lock:
+            self.interrupted = False
+
+    def shutdown(self) -> None:
+        # Same as interrupt(), for good (Ctrl+C, end of the program)
+        with self._lock:
+            self.closed = True
+        self._kill_all()
+
+
+RUNNER = ProcessRunner()
+atexit.register(RUNNER.shutdown)
+
+
+def run(
+    cmd: list[str],
+    timeout: float | None = None,
+    on_line: Callable[[str], None] | None = None,
+    pool: str = "tool",
+    capture_stderr: bool = True,
+) -> RunResult:
+    return RUNNER.run(cmd, timeout, on_line, pool, capture_stderr)
+
+
+@contextmanager
+def kill_on_interrupt(executor: Executor | None = None) -> Iterator[None]:
+    # Wrap thread pools: on Ctrl+C, drop the queued tasks and kill the children before the pool
+    # waits for its threads (the running tasks then get RunInterrupted)
+    try:
+        yield
+    except KeyboardInterrupt:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        RUNNER.shutdown()
+        raise
@@ -19,13 +19,24 @@ Modifie uniquement la section CONFIG.
 
 from __future__ import annotations
 
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
 from pathlib import Path
 import json
 import math
+import os
 import re
 import shutil
-import subprocess
 import sys
+import threading
+import time
+
+from QS02_inventaire import check_qs02_compatibility, peak_bitrate, scan_video_files
+from QS02_metrics import METRICS
+from QS02_probe_cache import ProbeCache, open_cache
+from QS02_runner import RunInterrupted, kill_on_interrupt, run
 
 # =========================
 # CONFIG (MODIFIER ICI)
@@ -50,6 +61,31 @@ BITRATE_SDR = "8M"  # Bitrate cible pour SDR
 MAXRATE_HDR, BUFSIZE_HDR = "25M", "50M"
 MAXRATE_SDR, BUFSIZE_SDR = "15M", "30M"
 
+# Bitrate adaptatif (ADAPTIVE_BITRATE = True):
+# - BITRATE_HDR / BITRATE_SDR deviennent la reference pour du 2160p a 24 i/s, mise a l'echelle selon
+#   les pixels par seconde de la source (exposant ADAPTIVE_EXPONENT: un 1080p recoit ~35% du 4K).
+# - Plafonnee a ADAPTIVE_SOURCE_RATIO x le bitrate video de la source (re-encoder une source deja
+#   legere a un bitrate superieur ne fait que grossir le fichier), bornee par ADAPTIVE_MIN_BITRATE
+#   et MAXRATE_HDR / MAXRATE_SDR.
+ADAPTIVE_BITRATE = False
+ADAPTIVE_REFERENCE = (3840, 2160, 24.0)
+ADAPTIVE_EXPONENT = 0.75
+ADAPTIVE_SOURCE_RATIO = 0.7
+ADAPTIVE_MIN_BITRATE = "2M"
+
+# Calibration VMAF (CALIBRATE = True), prioritaire sur ADAPTIVE_BITRATE:
+# - CALIBRATION_CLIPS extraits de CALIBRATION_CLIP_SECONDS (copie, sans re-encodage) repartis sur le film,
+#   encodes avec l'encodeur configure a chaque bitrate de CALIBRATION_BITRATES (<= MAXRATE_*), puis notes
+#   par libvmaf (ou SSIM si ffmpeg n'a pas libvmaf), CALIBRATION_WORKERS encodages en parallele.
+# - Le bitrate retenu est le plus bas dont la note moyenne atteint CALIBRATION_TARGET.
+# - Chaque note est gardee dans PROBE_CACHE_FILE: recalibrer (autre cible, autre liste) est quasi gratuit.
+CALIBRATE = False
+CALIBRATION_CLIPS = 4
+CALIBRATION_CLIP_SECONDS = 10
+CALIBRATION_BITRATES = ["3M", "4M", "6M", "8M", "10M", "12M", "16M", "20M"]
+CALIBRATION_TARGET = {"vmaf": 93.0, "ssim": 0.985}
+CALIBRATION_WORKERS = 2
+
 # Sous-titres:
 # - False = maximise Direct Play (moins de risques de burn-in côté Jellyfin).
 # - True  = copie les sous-titres (peut déclencher transcodage selon formats/client).
@@ -65,13 +101,136 @@ AAC_BITRATE = "192k"
 OVERWRITE = False
 DRY_RUN = False  # True = affiche juste les commandes
 
+# Reprise apres crash:
+# - La sortie est ecrite dans "<nom>.part.mkv" puis renommee une fois ffmpeg termine avec succes.
+# - SEGMENT_SECONDS > 0 = encode la video par tranches (ex: 600 = 10 min) dans ".<nom>.work/",
+#   l'audio une seule fois, puis assemble le tout (concat, sans re-encodage). Un job interrompu
+#   ne perd que la tranche en cours. 0 = un seul passage ffmpeg.
+SEGMENT_SECONDS = 0
+
+# Encodeur video:
+# - "auto" = premier encodeur de ENCODER_PREFERENCE present dans `ffmpeg -encoders` (et qui
+#   fonctionne reellement pour les encodeurs materiels: test d'encodage de quelques images).
+# - Ou un nom explicite: "av1_nvenc", "hevc_nvenc", "av1_qsv", "hevc_qsv", "av1_vaapi", "hevc_vaapi",
+#   "libsvtav1", "libx265", "libaom-av1".
+VIDEO_ENCODER = "auto"
+ENCODER_PREFERENCE = [
+    "av1_nvenc",
+    "av1_qsv",
+    "av1_vaapi",
+    "hevc_nvenc",
+    "hevc_qsv",
+    "hevc_vaapi",
+    "libsvtav1",
+    "libx265",
+    "libaom-av1",
+]
+QSV_PRESET = "slow"
+VAAPI_DEVICE = "/dev/dri/renderD128"
+SVTAV1_PRESET = "6"  # 0 (lent) .. 13 (rapide)
+# libsvtav1 ignore -maxrate/-bufsize en VBR: CRF plafonne (mbr = MAXRATE_*), le bitrate cible ne s'applique pas
+SVTAV1_CRF = "30"
+X265_PRESET = "slow"
+AOM_CPU_USED = "4"  # 0 (lent) .. 8 (rapide)
+
+# Decodage et filtres video:
+# - HW_DECODE = True: avec NVENC/QSV/VAAPI, la source est decodee par le GPU et les images y restent
+#   (-hwaccel_output_format). Reduction et conversion 10/8-bit sont faites sur le GPU (scale_cuda,
+#   vpp_qsv, scale_vaapi), sans aller-retour en memoire systeme. Si le codec / pix_fmt source n'est
+#   pas dans HW_DECODE_CODECS / HW_DECODE_PIX_FMTS, ou si le filtre manque dans ffmpeg: chaine logicielle.
+# - MAX_HEIGHT = hauteur maximale de sortie (ex: 1080). Une source plus haute est reduite (et donc
+#   re-encodee). None = resolution source.
+HW_DECODE = True
+HW_DECODE_CODECS = {"h264", "hevc", "av1", "vp9", "mpeg2video"}
+HW_DECODE_PIX_FMTS = {"yuv420p", "yuvj420p", "nv12", "yuv420p10le", "p010le"}
+MAX_HEIGHT = None
+
+# Variante basse resolution (Wi-Fi faible, QS02 loin du point d'acces):
+# - LADDER_HEIGHT = 1080: une seconde sortie "<titre>.<annee>.1080p.<HDR|SDR>.qs02.mkv" est produite
+#   dans le meme passage ffmpeg que la sortie principale (un seul decodage, filtre split, deux encodages),
+#   pour les sources plus hautes. None = pas de variante.
+# - Bitrate/plafonds propres a la variante. Une source remuxee garde la copie pour la sortie principale.
+# - La variante est produite en un seul passage: SEGMENT_SECONDS est ignore pour ces jobs.
+LADDER_HEIGHT = None
+LADDER_BITRATE_HDR = "6M"
+LADDER_BITRATE_SDR = "4M"
+LADDER_MAXRATE_HDR = "12M"
+LADDER_BUFSIZE_HDR = "24M"
+LADDER_MAXRATE_SDR = "8M"
+LADDER_BUFSIZE_SDR = "16M"
+
+# Encodage parallele des tranches (SEGMENT_SECONDS > 0):
+# - Les coupures sont alignees sur les images cles de la source (= changements de plan en general),
+#   cherchees dans les KEYFRAME_SEARCH_SECONDS suivant chaque coupure theorique.
+# - SEGMENT_WORKERS tranches encodees en meme temps (NVENC: 2-3 sessions max sur GPU grand public;
+#   logiciel: ~ nombre de coeurs / 4). L'audio est encode une seule fois en parallele des tranches.
+SEGMENT_WORKERS = 1
+KEYFRAME_SEARCH_SECONDS = 10
+
+# Telemetrie ffmpeg (-progress): evenements JSON (debut, progression, fin) avec fps, vitesse,
+# bitrate et ETA. None (defaut) = pas de fichier. Active (ex: OUT_DIR / "qs02_progress.jsonl"), le
+# fichier grandit a chaque run (pas de rotation) et ne doit pas etre partage entre processus (ferme).
+# Une ligne console toutes les PROGRESS_PRINT_SECONDS.
+PROGRESS_LOG = None
+PROGRESS_PRINT_SECONDS = 10
+
+# Mode batch (repertoire ou TSV d'inventaire en argument, ou IN_DIR sans argument):
+# - JOBS_FILE garde l'etat de chaque job (pending/running/done/failed/skipped) pour reprendre
+#   un batch interrompu la ou il s'est arrete.
+# - BATCH_WORKERS = nombre d'encodages simultanes (les GPU grand public limitent les sessions NVENC).
+JOBS_FILE = OUT_DIR / "qs02_jobs.json"
+BATCH_WORKERS = 1
+
+# Ordonnanceur du mode batch (SCHEDULER = True remplace BATCH_WORKERS):
+# - Chaque job prend des ressources: une session d'encodeur sur un GPU libre (SCHEDULER_GPU_SESSIONS,
+#   index GPU -> sessions simultanees) + SCHEDULER_CORES_HARDWARE coeurs (decodage, audio), sinon
+#   l'encodeur logiciel SCHEDULER_SOFTWARE_ENCODER avec SCHEDULER_CORES_SOFTWARE coeurs, multiplies par
+#   le nombre d'encodages simultanes du job (SEGMENT_WORKERS, CALIBRATION_WORKERS si CALIBRATE).
+#   Un remux, et la lecture d'une source avant decision (ffprobe, pic de bitrate), prennent un slot
+#   disque (SCHEDULER_IO_SLOTS) et un coeur. Un job attend qu'une ressource se libere.
+# - SCHEDULER_CPU_CORES = coeurs disponibles pour les jobs (None = tous). {} comme sessions GPU =
+#   logiciel uniquement; None comme encodeur logiciel = jamais de repli logiciel.
+# - SCHEDULER_PRIORITY = ordre des jobs, criteres successifs parmi "watchlist" (titres du fichier
+#   WATCHLIST_FILE d'abord, un fragment de nom par ligne), "smallest", "largest", "recent" (mtime).
+SCHEDULER = False
+SCHEDULER_GPU_SESSIONS = {GPU_INDEX: 2}
+SCHEDULER_CPU_CORES = None
+SCHEDULER_CORES_HARDWARE = 2
+SCHEDULER_CORES_SOFTWARE = 8
+SCHEDULER_IO_SLOTS = 2
+SCHEDULER_SOFTWARE_ENCODER = "libsvtav1"
+SCHEDULER_PRIORITY = ["watchlist", "smallest"]
+WATCHLIST_FILE = None
+
+# Remux sans re-encodage video:
+# - REMUX_IF_COMPLIANT = True: si la video source passe check_qs02_compatibility() de QS02_inventaire
+#   (codec H264/HEVC, bitrate sous les plafonds QS02, format pixel), elle est copiee (-c:v copy) et
+#   seules les pistes AC3/AAC sont construites. La decision est affichee et ecrite dans le .md.
+# - REMUX_CHECK_PEAK = True: verifie aussi le pic de bitrate par paquets avant de copier (lecture
+#   complete de la source, resultat garde dans PROBE_CACHE_FILE). Pic inconnu (analyse en echec ou
+#   au-dela de PEAK_SCAN_TIMEOUT de QS02_inventaire) = re-encodage.
+REMUX_IF_COMPLIANT = True
+REMUX_CHECK_PEAK = True
+
+# Cache ffprobe partage avec QS02_inventaire (cle: chemin + taille + mtime). None = desactive.
+PROBE_CACHE_FILE = Path("./qs02_probe_cache.sqlite")
+
+# Delai maximal (s) d'un ffprobe ou d'un test d'encodeur: un fichier reseau inaccessible ou un pilote
+# bloque est abandonne (processus tue) au lieu de bloquer tout le batch. None = sans limite.
+PROBE_TIMEOUT = 60
+
+# Metriques de fin de run (probe, nommage, markdown, encodage, re-probe): resume console,
+# plus fichier .json ou .csv si METRICS_FILE est defini.
+METRICS_FILE = None
+
 # =========================
 HDR_TRCS = {"smpte2084", "arib-std-b67"}  # PQ / HLG
 
 
-def cap(cmd: list[str]) -> tuple[int, str, str]:
-    p = subprocess.run(cmd, capture_output=True, text=True)
-    return p.returncode, p.stdout, p.stderr
+def cap(cmd: list[str], timeout: float | None = None, pool: str = "tool") -> tuple[int | None, str, str]:
+    # returncode is None when the command was killed on timeout (stderr says so)
+    result = run(cmd, timeout=timeout, pool=pool)
+    return result.returncode, *result.text()
 
 
 def need(binname: str) -> str:
@@ -81,16 +240,192 @@ def need(binname: str) -> str:
     return p
 
 
-def has_nvenc(ffmpeg: str) -> bool:
-    rc, out, _ = cap([ffmpeg, "-hide_banner", "-encoders"])
-    return rc == 0 and "av1_nvenc" in out
-
+class EncoderBackend:
+    # family: "nvenc", "qsv", "vaapi" (hardware) or "svtav1", "x265", "aom" (software)
+    def __init__(self, encoder: str, family: str, gpu: int = GPU_INDEX) -> None:
+        self.encoder = encoder
+        self.family = family
+        self.gpu = gpu
+
+    def on_gpu(self, gpu: int) -> EncoderBackend:
+        return EncoderBackend(self.encoder, self.family, gpu)
+
+    @property
+    def hardware(self) -> bool:
+        return self.family in {"nvenc", "qsv", "vaapi"}
+
+    @property
+    def capped_crf(self) -> bool:
+        # Quality target capped at maxrate: the bitrate target is not used
+        return self.family == "svtav1"
+
+    def device_args(self) -> list[str]:
+        # Global options that must come before the first -i
+        if self.family == "vaapi":
+            return ["-vaapi_device", VAAPI_DEVICE]
+        if self.family == "qsv":
+            return ["-init_hw_device", "qsv=hw", "-filter_hw_device", "hw"]
+        return []
+
+    def decode_args(self) -> list[str]:
+        # Decode on the encoder's device and keep the frames there (see plan_video_pipeline)
+        if self.family == "nvenc":
+            return ["-hwaccel", "cuda", "-hwaccel_device", str(self.gpu), "-hwaccel_output_format", "cuda"]
+        if self.family == "vaapi":
+            # "vaapi" is the device created by -vaapi_device
+            return ["-hwaccel", "vaapi", "-hwaccel_device", "vaapi", "-hwaccel_output_format", "vaapi"]
+        if self.family == "qsv":
+            return ["-hwaccel", "qsv", "-hwaccel_device", "hw", "-hwaccel_output_format", "qsv"]
+        return []
+
+    def video_args(
+        self,
+        hdr: bool,
+        trc: str,
+        bitrate: str,
+        maxrate: str,
+        bufsize: str,
+        vbv_init: float | None = None,
+        gpu: int | None = None,
+        pixel_args: list[str] | None = None,
+    ) -> list[str]:
+        gpu = self.gpu if gpu is None else gpu
+        params: list[str] = []
+        args = ["-c:v", self.encoder]
+        if self.family == "nvenc":
+            args += ["-gpu", str(gpu), "-preset", NVENC_PRESET, "-rc:v", "vbr"]
+        elif self.family == "qsv":
+            args += ["-preset", QSV_PRESET]
+        elif self.family == "vaapi":
+            args += ["-rc_mode", "VBR"]
+        elif self.family == "svtav1":
+            # Capped CRF: in VBR mode libsvtav1 silently drops -maxrate/-bufsize (mbr is in kbps)
+            args += ["-preset", SVTAV1_PRESET, "-crf", SVTAV1_CRF]
+            params.append(f"mbr={parse_rate(maxrate) // 1000}")
+            if hdr:
+                params.append("enable-hdr=1")
+        elif self.family == "x265":
+            args += ["-preset", X265_PRESET]
+            if hdr and trc == "smpte2084":
+                params.append("hdr10=1")
+            params.append("repeat-headers=1")
+        elif self.family == "aom":
+            args += ["-cpu-used", AOM_CPU_USED, "-row-mt", "1"]
+
+        if not self.capped_crf:
+            args += ["-b:v", bitrate, "-maxrate:v", maxrate, "-bufsize:v", bufsize]
+
+        # Pixel format: NVENC takes p010le directly, VAAPI/QSV need the frames uploaded to the device.
+        # pixel_args comes from plan_video_pipeline(); without it, frames are in system memory
+        if pixel_args is not None:
+            args += pixel_args
+        elif self.family in {"vaapi", "qsv"}:
+            upload = "hwupload" if self.family == "vaapi" else "hwupload=extra_hw_frames=64"
+            args += ["-vf", f"format={'p010le' if hdr else 'nv12'},{upload}"]
+        elif hdr:
+            args += ["-pix_fmt", "p010le" if self.family == "nvenc" else "yuv420p10le"]
+        else:
+            args += ["-pix_fmt", "yuv420p"]
 
-def probe(ffprobe: str, f: Path) -> tuple[list[dict], dict]:
-    rc, out, err = cap([ffprobe, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", str(f)])
+        if hdr:
+            args += ["-color_primaries", "bt2020", "-colorspace", "bt2020nc", "-color_trc", trc]
+        else:
+            args += ["-color_primaries", "bt709", "-colorspace", "bt709", "-color_trc", "bt709"]
+
+        # Initial VBV fullness (fraction of bufsize), used for segments so that the
+        # concatenated stream still honours maxrate/bufsize at the joins (no VBV in capped CRF)
+        if vbv_init is not None and not self.capped_crf:
+            if self.family == "x265":
+                params.append(f"vbv-init={vbv_init}")
+            else:
+                args += ["-rc_init_occupancy", str(int(parse_rate(bufsize) * vbv_init))]
+
+        if params and self.family == "x265":
+            args += ["-x265-params", ":".join(params)]
+        elif params and self.family == "svtav1":
+            args += ["-svtav1-params", ":".join(params)]
+        return args
+
+
+ENCODER_BACKENDS = {
+    "av1_nvenc": EncoderBackend("av1_nvenc", "nvenc"),
+    "hevc_nvenc": EncoderBackend("hevc_nvenc", "nvenc"),
+    "av1_qsv": EncoderBackend("av1_qsv", "qsv"),
+    "hevc_qsv": EncoderBackend("hevc_qsv", "qsv"),
+    "av1_vaapi": EncoderBackend("av1_vaapi", "vaapi"),
+    "hevc_vaapi": EncoderBackend("hevc_vaapi", "vaapi"),
+    "libsvtav1": EncoderBackend("libsvtav1", "svtav1"),
+    "libx265": EncoderBackend("libx265", "x265"),
+    "libaom-av1": EncoderBackend("libaom-av1", "aom"),
+}
+
+
+def list_encoders(ffmpeg: str) -> set[str]:
+    rc, out, _ = cap([ffmpeg, "-hide_banner", "-encoders"], PROBE_TIMEOUT)
+    if rc != 0:
+        return set()
+    names = set()
+    for line in out.splitlines():
+        parts = line.split()
+        # " V....D av1_nvenc   NVIDIA NVENC av1 encoder"
+        if len(parts) >= 2 and parts[0].startswith("V"):
+            names.add(parts[1])
+    return names
+
+
+@lru_cache(maxsize=None)
+def list_filters(ffmpeg: str) -> set[str]:
+    rc, out, _ = cap([ffmpeg, "-hide_banner", "-filters"], PROBE_TIMEOUT)
     if rc != 0:
-        raise RuntimeError(f"ffprobe failed: {f}\n{err}")
-    data = json.loads(out)
+        return set()
+    # " ... libvmaf           VV->V      Calculate the VMAF between two video streams."
+    return {parts[1] for parts in (line.split() for line in out.splitlines()) if len(parts) >= 3 and "->" in parts[2]}
+
+
+def backend_works(ffmpeg: str, backend: EncoderBackend) -> bool:
+    # Hardware encoders are listed even without the device/driver: encode a few frames to be sure
+    cmd = [ffmpeg, "-hide_banner", "-v", "error", *backend.device_args()]
+    cmd += ["-f", "lavfi", "-i", "color=c=black:s=256x256:r=25:d=0.2"]
+    cmd += backend.video_args(False, "bt709", "1M", "2M", "4M")
+    cmd += ["-frames:v", "3", "-f", "null", "-"]
+    rc, _, _ = cap(cmd, PROBE_TIMEOUT)
+    return rc == 0
+
+
+def select_backend(ffmpeg: str, name: str | None = None) -> EncoderBackend:
+    name = name or VIDEO_ENCODER
+    available = list_encoders(ffmpeg)
+    if name != "auto":
+        backend = ENCODER_BACKENDS.get(name)
+        if backend is None:
+            raise SystemExit(f"ERROR: Encodeur video non supporte: {name}")
+        if backend.encoder not in available:
+            raise SystemExit(f"ERROR: {name} non disponible dans ffmpeg.")
+        return backend
+    for candidate in ENCODER_PREFERENCE:
+        backend = ENCODER_BACKENDS[candidate]
+        if backend.encoder not in available:
+            continue
+        if backend.hardware and not backend_works(ffmpeg, backend):
+            continue
+        return backend
+    raise SystemExit("ERROR: Aucun encodeur video utilisable (ni materiel, ni logiciel) dans ffmpeg.")
+
+
+def probe(ffprobe: str, f: Path, cache: ProbeCache | None = None) -> tuple[list[dict], dict]:
+    data = cache.get(f) if cache else None
+    if cache:
+        METRICS.count("cache_ffprobe_hit" if data is not None else "cache_ffprobe_miss")
+    if data is None:
+        cmd = [ffprobe, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", str(f)]
+        with METRICS.timer("ffprobe"):
+            result = run(cmd, timeout=PROBE_TIMEOUT, pool="probe")
+        if not result.ok:
+            raise RuntimeError(f"ffprobe failed: {f}\n{result.text()[1]}")
+        # json parses the raw bytes: no intermediate decoded copy
+        data = json.loads(result.stdout)
+        if cache:
+            cache.put(f, data)
     return data.get("streams", []), data.get("format", {})
 
 
@@ -108,10 +443,17 @@ def get_language(stream: dict) -> str | None:
     return None
 
 
+def is_main_audio(stream: dict) -> bool:
+    # Commentary and accessibility tracks (audio description, hearing impaired) are never the main mix
+    disposition = stream.get("disposition") or {}
+    return not any(disposition.get(flag) for flag in ("comment", "visual_impaired", "hearing_impaired"))
+
+
 def best_audio(streams: list[dict]) -> dict | None:
     a = [s for s in streams if s.get("codec_type") == "audio"]
     if not a:
         return None
+    a = [s for s in a if is_main_audio(s)] or a
 
     # Priorite: francais > anglais > plus de canaux
     fr_audio = [s for s in a if get_language(s) == "fr"]
@@ -149,58 +491,216 @@ def get_resolution_p(video: dict) -> str:
     return ""
 
 
-def clean_filename(name: str) -> str:
-    # Technical keywords to remove (case-insensitive)
-    tech_keywords = (
-        r"HEVC|H\.?264|H264|AVC|X264|X265|H\.?265|H265|"
-        r"10[- ]?bit|8[- ]?bit|"
-        r"DTS(?:-HD)?|DTSHD|TrueHD|E[- ]?AC3|AC3|AAC|FLAC|MP3|"
-        r"Blu[- ]?Ray|BDRip|BDR|WEB[- ]?Rip|WEB[- ]?DL|WEB|HDTV|DVD[- ]?Rip|DVD|"
-        r"REMUX|REMASTERED|MULTI|"
-        r"2160p|1080p|720p|480p|4K|UHD|"
-        r"HDR10?\+?|DV|Dolby\s+Vision|HLG|"
-        r"DD\+|DD5\.1|DD7\.1|5\.1|7\.1|2\.0|"
-        r"AMZN|NF|HMAX|Hulu|iTunes|iT"
-    )
+# On-device scaler per hardware family, and the pixel format name it takes for 10-bit / 8-bit
+DEVICE_SCALERS = {
+    "nvenc": ("scale_cuda", "p010le", "nv12"),
+    "vaapi": ("scale_vaapi", "p010", "nv12"),
+    "qsv": ("vpp_qsv", "p010", "nv12"),
+}
+PIX_BITS_RE = re.compile(r"p(\d+)(?:le|be)$")
+
 
-    # Remove technical keywords with word boundaries
-    cleaned = re.sub(rf"\b({tech_keywords})\b", "", name, flags=re.IGNORECASE)
+def pix_fmt_bits(pix_fmt: str) -> int:
+    # "yuv420p10le" / "p010le" -> 10, "yuv420p" / "nv12" -> 8
+    match = PIX_BITS_RE.search(pix_fmt)
+    return int(match.group(1)) if match else 8
 
-    # Remove brackets/parens containing technical keywords
-    cleaned = re.sub(rf"\[({tech_keywords})\w*\]", "", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(rf"\(({tech_keywords})\w*\)", "", cleaned, flags=re.IGNORECASE)
+
+def scaled_size(video: dict, max_height: int | None) -> tuple[int, int] | None:
+    # Output (width, height) when the source must be downscaled, else None
+    width = int(video.get("width") or 0)
+    height = int(video.get("height") or 0)
+    if not max_height or height <= max_height or width <= 0:
+        return None
+    return int(round(width * max_height / height / 2)) * 2, max_height
+
+
+def hw_decodable(video: dict) -> bool:
+    codec = video.get("codec_name") or ""
+    pix_fmt = video.get("pix_fmt") or ""
+    if codec not in HW_DECODE_CODECS or pix_fmt not in HW_DECODE_PIX_FMTS:
+        return False
+    # 10-bit H.264 (Hi10P) has no hardware decoder
+    return not (codec == "h264" and pix_fmt_bits(pix_fmt) > 8)
+
+
+class VideoPipeline:
+    # Path of the frames from decoder to encoder: decode options, filter chain, output pix_fmt
+    def __init__(
+        self, decode: list[str], filters: list[str], pix_fmt: str | None, on_device: bool, size: tuple[int, int] | None
+    ) -> None:
+        self.decode = decode
+        self.filters = filters
+        self.pix_fmt = pix_fmt
+        self.on_device = on_device
+        self.size = size
+
+    def filter_args(self) -> list[str]:
+        args = ["-vf", ",".join(self.filters)] if self.filters else []
+        return args + (["-pix_fmt", self.pix_fmt] if self.pix_fmt else [])
+
+    def graph_chain(self) -> str:
+        # Same steps as one filter_complex branch (several outputs cannot share -vf / -pix_fmt)
+        steps = self.filters + ([f"format={self.pix_fmt}"] if self.pix_fmt else [])
+        return ",".join(steps) or "null"
+
+    def describe(self) -> str:
+        steps = self.filters + ([f"pix_fmt {self.pix_fmt}"] if self.pix_fmt else [])
+        return f"{'GPU' if self.on_device else 'logiciel'} ({', '.join(steps) or 'sans conversion'})"
+
+
+def plan_video_pipeline(
+    backend: EncoderBackend,
+    video: dict,
+    hdr: bool,
+    filters: set[str],
+    max_height: int | None = None,
+    hw_decode: bool = HW_DECODE,
+) -> VideoPipeline:
+    src_fmt = video.get("pix_fmt") or ""
+    size = scaled_size(video, max_height)
+    convert = pix_fmt_bits(src_fmt) != (10 if hdr else 8)
+
+    # Frames stay on the device when it can decode the source and do the scaling/conversion itself
+    scaler = DEVICE_SCALERS.get(backend.family)
+    if scaler and hw_decode and hw_decodable(video):
+        name, fmt_10, fmt_8 = scaler
+        if not (size or convert):
+            return VideoPipeline(backend.decode_args(), [], None, True, None)
+        if name in filters:
+            opts = [f"w={size[0]}", f"h={size[1]}"] if size else []
+            if convert:
+                opts.append(f"format={fmt_10 if hdr else fmt_8}")
+            return VideoPipeline(backend.decode_args(), [f"{name}={':'.join(opts)}"], None, True, size)
+
+    # Software chain: a single swscale pass resizes and converts; nothing when the source already fits
+    chain = [f"scale={size[0]}:{size[1]}"] if size else []
+    if backend.family in {"vaapi", "qsv"}:
+        upload = "hwupload" if backend.family == "vaapi" else "hwupload=extra_hw_frames=64"
+        chain += [f"format={'p010le' if hdr else 'nv12'}", upload]
+        return VideoPipeline([], chain, None, False, size)
+    if hdr:
+        target = "p010le" if backend.family == "nvenc" else "yuv420p10le"
+    else:
+        target = "yuv420p"
+    return VideoPipeline([], chain, None if src_fmt == target else target, False, size)
+
+
+# Technical keywords to remove (case-insensitive), compiled once for batch/inventory use
+TECH_KEYWORDS = (
+    r"HEVC|H\.?264|H264|AVC|X264|X265|H\.?265|H265|"
+    r"10[- ]?bit|8[- ]?bit|"
+    r"DTS(?:-HD)?|DTSHD|TrueHD|E[- ]?AC3|AC3|AAC|FLAC|MP3|"
+    r"Blu[- ]?Ray|BDRip|BDR|WEB[- ]?Rip|WEB[- ]?DL|WEB|HDTV|DVD[- ]?Rip|DVD|"
+    r"REMUX|REMASTERED|MULTI|"
+    r"2160p|1080p|720p|480p|4K|UHD|"
+    r"HDR(?:10)?\+?|DV|Dolby\s+Vision|HLG|"
+    r"DD\+|DD5\.1|DD7\.1|5\.1|7\.1|2\.0|"
+    r"AMZN|NF|HMAX|Hulu|iTunes|iT"
+)
+# (?!\w) instead of \b so that keywords ending in "+" (HDR10+, DD+) are removed too
+TECH_WORD_RE = re.compile(rf"\b({TECH_KEYWORDS})(?!\w)", re.IGNORECASE)
+TECH_BRACKET_RE = re.compile(rf"\[({TECH_KEYWORDS})\w*\]|\(({TECH_KEYWORDS})\w*\)", re.IGNORECASE)
+EMPTY_BRACKETS_RE = re.compile(r"\(\s*\)|\[\s*\]")
+SPACES_RE = re.compile(r"\s+")
+DOTS_RE = re.compile(r"\.+")
+# Separators left at either end once the technical tokens are cut ("Film.-", "Film -")
+EDGES_RE = re.compile(r"^[\s._-]+|[\s._-]+$")
+YEAR_RE = re.compile(r"\b(?:19|20)\d{2}\b")
+SEASON_EPISODE_RE = re.compile(r"\bS(\d{1,2})[ .]?E(\d{1,3})\b", re.IGNORECASE)
+# "-GROUP" at the end of the name, right after a technical keyword (x264-GRP, 7.1-FGT, H.264-NTb)
+RELEASE_GROUP_RE = re.compile(r"\w+")
+TECH_TOKEN_RE = re.compile(rf"(?:{TECH_KEYWORDS})", re.IGNORECASE)
+TOKEN_SEPARATORS = " ._[(-"
+
+
+def tech_suffix(head: str) -> str | None:
+    # Keyword ending the name; only tried right after a separator within the last 16 characters
+    for i in range(max(0, len(head) - 16), len(head)):
+        if (i == 0 or head[i - 1] in TOKEN_SEPARATORS) and TECH_TOKEN_RE.fullmatch(head, i):
+            return head[i:]
+    return None
+
+
+@lru_cache(maxsize=65536)
+def clean_filename(name: str) -> str:
+    # Remove technical keywords, then brackets/parens containing technical keywords
+    cleaned = TECH_WORD_RE.sub("", name)
+    cleaned = TECH_BRACKET_RE.sub("", cleaned)
+    # "Film (2019) [x264]" leaves "()" / "[]" behind
+    cleaned = EMPTY_BRACKETS_RE.sub("", cleaned)
 
     # Clean up multiple spaces, dots, and trim
-    cleaned = re.sub(r"\s+", " ", cleaned)
-    cleaned = re.sub(r"\.+", ".", cleaned)
-    cleaned = re.sub(r"[\.\s]+$", "", cleaned)
-    cleaned = re.sub(r"^[\.\s]+", "", cleaned)
+    cleaned = SPACES_RE.sub(" ", cleaned)
+    cleaned = DOTS_RE.sub(".", cleaned)
+    cleaned = EDGES_RE.sub("", cleaned)
     return cleaned.strip()
 
 
-def extract_movie_info(filename: str) -> tuple[str, str | None]:
+@lru_cache(maxsize=65536)
+def parse_release_name(filename: str) -> tuple[str, str | None, int | None, int | None, str | None]:
+    # (title, year, season, episode, release group)
     stem = Path(filename).stem
-    # Try to extract year (4 digits between 1900-2100)
-    year_match = re.search(r"\b(19|20)\d{2}\b", stem)
-    year = year_match.group(0) if year_match else None
 
-    # Clean the filename to get movie title
-    cleaned = clean_filename(stem)
+    group = None
+    head, dash, tail = stem.rpartition("-")
+    if dash and RELEASE_GROUP_RE.fullmatch(tail):
+        keyword = tech_suffix(head)
+        if keyword and TECH_WORD_RE.fullmatch(f"{keyword}-{tail}"):
+            pass  # compound keyword (WEB-DL, DTS-HD), removed whole by clean_filename
+        elif TECH_WORD_RE.fullmatch(tail):
+            # Keyword-only "-HDR" belongs to the technical block, it is not a group
+            stem = head
+        elif keyword:
+            group = tail
+            stem = head
+
+    season = episode = None
+    se_match = SEASON_EPISODE_RE.search(stem)
+    if se_match:
+        season, episode = int(se_match.group(1)), int(se_match.group(2))
+
+    # Last year-like token: "Blade Runner 2049 (2017)" -> 2017
+    years = [m for m in YEAR_RE.finditer(stem) if m.start() > 0] or list(YEAR_RE.finditer(stem))
+    year_match = years[-1] if years else None
+    year = year_match.group(0) if year_match else None
 
-    # Remove year from cleaned name if found
-    if year:
-        cleaned = re.sub(r"\b" + re.escape(year) + r"\b", "", cleaned, flags=re.IGNORECASE)
-        cleaned = clean_filename(cleaned)  # Re-clean after removing year
+    # Title = stem minus the episode tag and the year, cut by position and cleaned once. A series
+    # title is the show name before SxxEyy; a name starting with the tag keeps what follows it.
+    start, end = 0, len(stem)
+    if se_match:
+        if stem[: se_match.start()].strip(TOKEN_SEPARATORS):
+            end = se_match.start()
+        else:
+            start = se_match.end()
+    if year_match and start <= year_match.start() and year_match.end() <= end:
+        title = stem[start : year_match.start()] + stem[year_match.end() : end]
+    else:
+        title = stem[start:end]
+    cleaned = clean_filename(title)
 
     # If cleaned is empty or too short, use original stem as fallback
     if not cleaned or len(cleaned) < 2:
-        cleaned = stem
+        cleaned = Path(filename).stem
 
-    return cleaned, year
+    return cleaned, year, season, episode, group
+
+
+def extract_movie_info(filename: str) -> tuple[str, str | None]:
+    title, year, _, _, _ = parse_release_name(filename)
+    return title, year
 
 
-def build_output_name(movie_title: str, year: str | None, resolution: str, hdr_tag: str) -> str:
+def episode_tag(season: int | None, episode: int | None) -> str | None:
+    return f"S{season:02d}E{episode:02d}" if season is not None and episode is not None else None
+
+
+def build_output_name(
+    movie_title: str, year: str | None, resolution: str, hdr_tag: str, episode: str | None = None
+) -> str:
     parts = [movie_title]
+    if episode:
+        parts.append(episode)
     if year:
         parts.append(year)
     if resolution:
@@ -276,6 +776,8 @@ def create_md_file(
     target_audio_info: dict | None,
     target_streams_info: list[dict],
     target_format_info: dict,
+    video_action: str = "",
+    stream_plan: list[str] | None = None,
 ) -> None:
     lines: list[str] = []
 
@@ -315,11 +817,13 @@ def create_md_file(
             "",
             f"**Source:** `{source_name}`",
             f"**Cible:** `{target_name}`",
-            "",
-            "## Tableau de comparaison",
+            *([f"**Video:** {video_action}"] if video_action else []),
             "",
         ]
     )
+    if stream_plan:
+        lines.extend(["## Plan des flux", "", *(f"- {line}" for line in stream_plan), ""])
+    lines.extend(["## Tableau de comparaison", ""])
 
     # Container
     add_section(
@@ -427,6 +931,275 @@ def create_md_file(
     md_path.write_text("\n".join(lines), encoding="utf-8")
 
 
+def plan_audio(best_audio_stream: dict | None, all_streams: list[dict]) -> list[tuple[int, str]]:
+    # (source audio index, action) for output track 0 (AC3) and track 1 (AAC stereo)
+    if not best_audio_stream:
+        return []
+    all_audio_in_file = [s for s in all_streams if s.get("codec_type") == "audio"]
+    best_idx = all_audio_in_file.index(best_audio_stream)
+
+    # Track 0: an AC3 source with compatible channels is copied
+    src_codec = (best_audio_stream.get("codec_name") or "").lower()
+    ch = int(best_audio_stream.get("channels") or 0)
+    ac3 = (best_idx, "copy" if src_codec == "ac3" and ch in {2, 6} else "ac3")
+
+    # Track 1: downmix of the best track, copied when that track already is a main AAC stereo mix.
+    # Other AAC stereo tracks are not reused: nothing says they carry the same mix (commentary,
+    # audio description, untagged language)
+    reuse = src_codec == "aac" and ch == 2 and is_main_audio(best_audio_stream)
+    aac = (best_idx, "copy" if reuse else "aac")
+    return [ac3, aac]
+
+
+def audio_map_args(best_audio_stream: dict | None, all_streams: list[dict], input_index: int = 0) -> list[str]:
+    args: list[str] = []
+    for audio_idx, _ in plan_audio(best_audio_stream, all_streams):
+        args += ["-map", f"{input_index}:a:{audio_idx}"]
+    return args
+
+
+def video_codec_args(
+    backend: EncoderBackend,
+    hdr: bool,
+    trc: str,
+    vbv_init: float | None = None,
+    bitrate: str | None = None,
+    pipeline: VideoPipeline | None = None,
+    in_graph: bool = False,
+) -> list[str]:
+    # in_graph: the pipeline already runs in -filter_complex
+    pixel_args = ([] if in_graph else pipeline.filter_args()) if pipeline else None
+    if hdr:
+        return backend.video_args(
+            hdr, trc, bitrate or BITRATE_HDR, MAXRATE_HDR, BUFSIZE_HDR, vbv_init, pixel_args=pixel_args
+        )
+    return backend.video_args(hdr, trc, bitrate or BITRATE_SDR, MAXRATE_SDR, BUFSIZE_SDR, vbv_init, pixel_args=pixel_args)
+
+
+def parse_fps(video: dict) -> float:
+    for key in ("avg_frame_rate", "r_frame_rate"):
+        num, _, den = (video.get(key) or "").partition("/")
+        try:
+            fps = float(num) / float(den or 1)
+        except (ValueError, ZeroDivisionError):
+            continue
+        if 0 < fps < 1000:
+            return fps
+    return ADAPTIVE_REFERENCE[2]
+
+
+def source_video_bitrate(video: dict, all_streams: list[dict], format_info: dict) -> int:
+    # Stream bit_rate (MP4), Matroska BPS statistics tag, else container rate minus audio
+    tags = video.get("tags") or {}
+    for value in (video.get("bit_rate"), tags.get("BPS"), tags.get("BPS-eng")):
+        try:
+            if value and int(value) > 0:
+                return int(value)
+        except ValueError:
+            continue
+    try:
+        total = int(format_info.get("bit_rate") or 0)
+    except ValueError:
+        return 0
+    audio = 0
+    for stream in all_streams:
+        if stream.get("codec_type") == "audio":
+            try:
+                audio += int(stream.get("bit_rate") or 0)
+            except ValueError:
+                pass
+    return max(0, total - audio)
+
+
+def target_bitrate(
+    video: dict, all_streams: list[dict], format_info: dict, hdr: bool, size: tuple[int, int] | None = None
+) -> tuple[str, str]:
+    # Returns (ffmpeg rate, explanation); size is the encoded (width, height) when the pipeline scales
+    reference = BITRATE_HDR if hdr else BITRATE_SDR
+    if not ADAPTIVE_BITRATE:
+        return reference, "fixe"
+    if size:
+        width, height = size
+    else:
+        width = int(video.get("width") or 0) or ADAPTIVE_REFERENCE[0]
+        height = int(video.get("height") or 0) or ADAPTIVE_REFERENCE[1]
+    fps = parse_fps(video)
+    ref_w, ref_h, ref_fps = ADAPTIVE_REFERENCE
+    scale = (width * height * fps / (ref_w * ref_h * ref_fps)) ** ADAPTIVE_EXPONENT
+    target = parse_rate(reference) * scale
+    source = source_video_bitrate(video, all_streams, format_info)
+    if source > 0:
+        target = min(target, source * ADAPTIVE_SOURCE_RATIO)
+    maxrate = parse_rate(MAXRATE_HDR if hdr else MAXRATE_SDR)
+    target = min(max(target, parse_rate(ADAPTIVE_MIN_BITRATE)), maxrate)
+    source_txt = f"{source / 1e6:.1f}M" if source else "inconnu"
+    return f"{int(target) // 1000}k", f"adaptatif: {width}x{height}@{fps:.3g}, source {source_txt}"
+
+
+def audio_codec_args(best_audio_stream: dict | None, all_streams: list[dict]) -> list[str]:
+    args: list[str] = []
+    for track, (_, action) in enumerate(plan_audio(best_audio_stream, all_streams)):
+        if action == "copy":
+            args += [f"-c:a:{track}", "copy"]
+        elif action == "ac3":
+            # Track 0: AC3 5.1 (or 2.0) for soundbar (HT-S40R)
+            ch = int(best_audio_stream.get("channels") or 0)
+            args += [f"-c:a:{track}", "ac3", f"-b:a:{track}", AC3_BITRATE, f"-ac:a:{track}", "6" if ch >= 6 else "2"]
+        else:
+            # Track 1: AAC stereo for headphones/compatibility (always downmix to stereo)
+            args += [f"-c:a:{track}", "aac", f"-b:a:{track}", AAC_BITRATE, f"-ac:a:{track}", "2"]
+    return args
+
+
+def describe_stream(stream: dict) -> str:
+    lang = (stream.get("tags") or {}).get("language") or "und"
+    channels = f" {stream['channels']}ch" if stream.get("channels") else ""
+    return f"{stream.get('codec_name', 'unknown')}{channels} {lang}"
+
+
+def plan_streams(
+    best_audio_stream: dict | None, all_streams: list[dict], copy_video: bool, video_issues: list[str], encoder: str
+) -> list[str]:
+    # Human-readable per-stream actions (copy / transcode / drop), in source order
+    audio_plan = plan_audio(best_audio_stream, all_streams)
+    lines = []
+    type_counts: dict[str, int] = {}
+    for stream in all_streams:
+        kind = stream.get("codec_type") or "data"
+        idx = type_counts.get(kind, 0)
+        type_counts[kind] = idx + 1
+        label = f"{kind} #{idx} ({describe_stream(stream)})"
+        if kind == "video":
+            if idx > 0:
+                lines.append(f"{label}: ignore")
+            elif copy_video:
+                lines.append(f"{label}: copie")
+            else:
+                lines.append(f"{label}: transcodage {encoder} ({'; '.join(video_issues)})")
+        elif kind == "audio":
+            actions = []
+            for track, (audio_idx, action) in enumerate(audio_plan):
+                if audio_idx != idx:
+                    continue
+                target = "AC3" if track == 0 else "AAC stereo"
+                actions.append(f"piste {track} {target} {'copie' if action == 'copy' else 'transcodage'}")
+            lines.append(f"{label}: {', '.join(actions) if actions else 'ignore'}")
+        elif kind == "subtitle":
+            lines.append(f"{label}: {'copie' if KEEP_SUBS else 'ignore (KEEP_SUBS = False)'}")
+        else:
+            lines.append(f"{label}: ignore")
+    return lines
+
+
+def clip_score(
+    ffmpeg: str, encoded: Path, reference: Path, metric: str, size: tuple[int, int] | None = None
+) -> float | None:
+    # A downscaled encode is compared with the reference scaled to the same size
+    ref = f"[1:v]scale={size[0]}:{size[1]}[ref];[0:v][ref]" if size else "[0:v][1:v]"
+    graph = f"{ref}libvmaf" if metric == "vmaf" else f"{ref}ssim"
+    rc, _, err = cap([ffmpeg, "-hide_banner", "-i", str(encoded), "-i", str(reference), "-lavfi", graph, "-f", "null", "-"])
+    if rc != 0:
+        return None
+    pattern = r"VMAF score[:=]\s*([\d.]+)" if metric == "vmaf" else r"SSIM .*All:([\d.]+)"
+    match = re.search(pattern, err)
+    return float(match.group(1)) if match else None
+
+
+def calibrate_bitrate(
+    ffmpeg: str,
+    inp: Path,
+    outp: Path,
+    hdr: bool,
+    trc: str,
+    backend: EncoderBackend,
+    duration: float,
+    cache: ProbeCache | None = None,
+    pipeline: VideoPipeline | None = None,
+) -> tuple[str, str] | None:
+    # Returns (ffmpeg rate, explanation), or None when no clip could be scored
+    metric = "vmaf" if "libvmaf" in list_filters(ffmpeg) else "ssim"
+    maxrate = MAXRATE_HDR if hdr else MAXRATE_SDR
+    bufsize = BUFSIZE_HDR if hdr else BUFSIZE_SDR
+    candidates = sorted((b for b in CALIBRATION_BITRATES if parse_rate(b) <= parse_rate(maxrate)), key=parse_rate)
+    candidates = candidates or [maxrate]
+    clip_len = min(CALIBRATION_CLIP_SECONDS, duration / max(1, CALIBRATION_CLIPS))
+    starts = [round(duration * (k + 1) / (CALIBRATION_CLIPS + 1), 1) for k in range(CALIBRATION_CLIPS)]
+
+    size = pipeline.size if pipeline else None
+    scale = f":{size[0]}x{size[1]}" if size else ""
+
+    def kind(start: float, bitrate: str) -> str:
+        mode = "hdr" if hdr else "sdr"
+        return f"calibration:{metric}:{backend.encoder}:{mode}{scale}:{maxrate}/{bufsize}:{start}+{clip_len:g}:{bitrate}"
+
+    scores: dict[tuple[float, str], float] = {}
+    missing = []
+    for start in starts:
+        for bitrate in candidates:
+            cached = cache.get_analysis(inp, kind(start, bitrate)) if cache else None
+            if cached is not None:
+                scores[(start, bitrate)] = cached
+            else:
+                missing.append((start, bitrate))
+    if scores:
+        METRICS.count("calibration_cache_hit", len(scores))
+
+    if missing:
+        work = outp.with_name(f".{outp.stem}.calib")
+        work.mkdir(parents=True, exist_ok=True)
+        clips = {start: work / f"clip_{k}.mkv" for k, start in enumerate(starts)}
+
+        def extract(start: float) -> None:
+            cmd = [ffmpeg, "-hide_banner", "-y", "-ss", f"{start:.3f}", "-i", str(inp), "-t", f"{clip_len:.3f}"]
+            cmd += ["-map", "0:v:0", "-an", "-sn", "-dn", "-c", "copy", str(clips[start])]
+            if cap(cmd)[0] != 0:
+                clips[start].unlink(missing_ok=True)
+
+        def score(point: tuple[float, str]) -> None:
+            start, bitrate = point
+            clip = clips[start]
+            if not clip.exists():
+                return
+            encoded = work / f"{clip.stem}_{bitrate}.mkv"
+            cmd = [ffmpeg, "-hide_banner", "-y", *backend.device_args(), *(pipeline.decode if pipeline else [])]
+            cmd += ["-i", str(clip), "-map", "0:v:0"]
+            cmd += video_codec_args(backend, hdr, trc, bitrate=bitrate, pipeline=pipeline) + [str(encoded)]
+            if cap(cmd)[0] != 0:
+                return
+            value = clip_score(ffmpeg, encoded, clip, metric, size)
+            encoded.unlink(missing_ok=True)
+            if value is None:
+                return
+            scores[point] = value
+            if cache:
+                cache.put_analysis(inp, kind(start, bitrate), value)
+
+        print(f"CALIBRATION: {len(missing)} encodage(s) de {clip_len:g}s ({metric}, {CALIBRATION_WORKERS} en parallele)")
+        with (
+            METRICS.timer("calibration"),
+            ThreadPoolExecutor(max_workers=max(1, CALIBRATION_WORKERS)) as pool,
+            kill_on_interrupt(pool),
+        ):
+            list(pool.map(extract, sorted({start for start, _ in missing})))
+            list(pool.map(score, missing))
+        shutil.rmtree(work, ignore_errors=True)
+
+    target = CALIBRATION_TARGET[metric]
+    means = {}
+    for bitrate in candidates:
+        values = [scores[(start, bitrate)] for start in starts if (start, bitrate) in scores]
+        if values:
+            means[bitrate] = sum(values) / len(values)
+    if not means:
+        return None
+    summary = ", ".join(f"{b}={v:.3g}" for b, v in means.items())
+    for bitrate, mean in means.items():
+        if mean >= target:
+            return bitrate, f"calibre: {metric} {mean:.3g} >= {target:g} ({summary})"
+    best = list(means)[-1]
+    return best, f"calibre: cible {metric} {target:g} non atteinte, bitrate max teste ({summary})"
+
+
 def ffmpeg_cmd(
     ffmpeg: str,
     inp: Path,
@@ -435,195 +1208,959 @@ def ffmpeg_cmd(
     trc: str,
     best_audio_stream: dict | None,
     all_streams: list[dict],
+    backend: EncoderBackend = ENCODER_BACKENDS["av1_nvenc"],
+    copy_video: bool = False,
+    bitrate: str | None = None,
+    pipeline: VideoPipeline | None = None,
 ) -> list[str]:
-    cmd = [ffmpeg, "-hide_banner", "-y" if OVERWRITE else "-n", "-hwaccel", "cuda", "-i", str(inp)]
+    cmd = [ffmpeg, "-hide_banner", "-y" if OVERWRITE else "-n"]
+    if not copy_video:
+        cmd += [*backend.device_args(), *(pipeline.decode if pipeline else [])]
+    cmd += ["-i", str(inp)]
     cmd += ["-map", "0:v:0"]
-
-    # Map the best audio stream twice: once for AC3, once for AAC stereo
-    all_audio_in_file = [s for s in all_streams if s.get("codec_type") == "audio"]
-    if best_audio_stream:
-        audio_idx = all_audio_in_file.index(best_audio_stream)
-        # Map same source twice: Track 0 (AC3) and Track 1 (AAC stereo)
-        cmd += ["-map", f"0:a:{audio_idx}"]
-        cmd += ["-map", f"0:a:{audio_idx}"]
+    cmd += audio_map_args(best_audio_stream, all_streams)
 
     if KEEP_SUBS:
         cmd += ["-map", "0:s?"]
 
     cmd += ["-map_metadata", "0", "-map_chapters", "0"]
-    cmd += [
-        "-c:v",
-        "av1_nvenc",
-        "-gpu",
-        str(GPU_INDEX),
-        "-preset",
-        NVENC_PRESET,
-        "-rc:v",
-        "vbr",
-    ]
+    cmd += ["-c:v", "copy"] if copy_video else video_codec_args(backend, hdr, trc, bitrate=bitrate, pipeline=pipeline)
+    cmd += audio_codec_args(best_audio_stream, all_streams)
+
+    if KEEP_SUBS:
+        cmd += ["-c:s", "copy"]
+
+    cmd += [str(outp)]
+    return cmd
+
+
+def ladder_size(video: dict) -> tuple[int, int] | None:
+    # Size of the low-resolution variant, when the main output is taller than LADDER_HEIGHT
+    main = scaled_size(video, MAX_HEIGHT) or (int(video.get("width") or 0), int(video.get("height") or 0))
+    return scaled_size({"width": main[0], "height": main[1]}, LADDER_HEIGHT)
+
+
+def plan_ladder(
+    backend: EncoderBackend, video: dict, hdr: bool, filters: set[str], pipeline: VideoPipeline | None
+) -> tuple[VideoPipeline | None, VideoPipeline]:
+    # Both renditions share one decode: if they disagree on where frames live, both go software
+    low = plan_video_pipeline(backend, video, hdr, filters, LADDER_HEIGHT)
+    if pipeline is not None and pipeline.decode != low.decode:
+        pipeline = plan_video_pipeline(backend, video, hdr, filters, MAX_HEIGHT, hw_decode=False)
+        low = plan_video_pipeline(backend, video, hdr, filters, LADDER_HEIGHT, hw_decode=False)
+    return pipeline, low
+
+
+def ladder_cmd(
+    ffmpeg: str,
+    inp: Path,
+    outp: Path,
+    low_outp: Path,
+    hdr: bool,
+    trc: str,
+    best_audio_stream: dict | None,
+    all_streams: list[dict],
+    backend: EncoderBackend,
+    pipeline: VideoPipeline | None,
+    low_pipeline: VideoPipeline,
+    bitrate: str | None = None,
+) -> list[str]:
+    # One input, one decode: split feeds the main encode and the downscaled one
+    # (a copied main video stream does not go through the graph at all)
+    cmd = [ffmpeg, "-hide_banner", "-y" if OVERWRITE else "-n", *backend.device_args(), *low_pipeline.decode]
+    cmd += ["-i", str(inp)]
+    if pipeline is None:
+        graph = f"[0:v:0]{low_pipeline.graph_chain()}[v1]"
+    else:
+        graph = f"[0:v:0]split=2[main][low];[main]{pipeline.graph_chain()}[v0];[low]{low_pipeline.graph_chain()}[v1]"
+    cmd += ["-filter_complex", graph]
 
     if hdr:
-        cmd += [
-            "-b:v",
-            BITRATE_HDR,
-            "-maxrate:v",
-            MAXRATE_HDR,
-            "-bufsize:v",
-            BUFSIZE_HDR,
-            "-pix_fmt",
-            "p010le",
-            "-color_primaries",
-            "bt2020",
-            "-colorspace",
-            "bt2020nc",
-            "-color_trc",
-            trc,
-        ]
+        low_rates = (LADDER_BITRATE_HDR, LADDER_MAXRATE_HDR, LADDER_BUFSIZE_HDR)
     else:
-        cmd += [
-            "-b:v",
-            BITRATE_SDR,
-            "-maxrate:v",
-            MAXRATE_SDR,
-            "-bufsize:v",
-            BUFSIZE_SDR,
-            "-pix_fmt",
-            "yuv420p",
-            "-color_primaries",
-            "bt709",
-            "-colorspace",
-            "bt709",
-            "-color_trc",
-            "bt709",
+        low_rates = (LADDER_BITRATE_SDR, LADDER_MAXRATE_SDR, LADDER_BUFSIZE_SDR)
+    # Main output last: run_step() and the progress events treat the last argument as the output
+    outputs = [
+        (low_outp, "[v1]", backend.video_args(hdr, trc, *low_rates, pixel_args=[])),
+        (
+            outp,
+            "0:v:0" if pipeline is None else "[v0]",
+            ["-c:v", "copy"]
+            if pipeline is None
+            else video_codec_args(backend, hdr, trc, bitrate=bitrate, pipeline=pipeline, in_graph=True),
+        ),
+    ]
+    for path, video_map, video_args in outputs:
+        cmd += ["-map", video_map]
+        cmd += audio_map_args(best_audio_stream, all_streams)
+        if KEEP_SUBS:
+            cmd += ["-map", "0:s?"]
+        cmd += ["-map_metadata", "0", "-map_chapters", "0"]
+        cmd += video_args
+        cmd += audio_codec_args(best_audio_stream, all_streams)
+        if KEEP_SUBS:
+            cmd += ["-c:s", "copy"]
+        cmd += [str(path)]
+    return cmd
+
+
+def video_copy_decision(
+    ffprobe: str, inp: Path, video: dict, format_info: dict, cache: ProbeCache | None = None
+) -> tuple[bool, list[str]]:
+    # Same criteria as the inventory: a compliant video stream is copied, not re-encoded
+    if not REMUX_IF_COMPLIANT:
+        return False, ["REMUX_IF_COMPLIANT = False"]
+    if scaled_size(video, MAX_HEIGHT):
+        return False, [f"Hauteur {video.get('height')} > MAX_HEIGHT ({MAX_HEIGHT})"]
+    compatible, issues = check_qs02_compatibility(format_info, video)
+    if compatible and REMUX_CHECK_PEAK:
+        # Full packet scan only for sources that pass every cheap check
+        hdr, _ = is_hdr(video)
+        peak = peak_bitrate(ffprobe, inp, hdr, cache)
+        if peak is None:
+            # Failed or timed out scan: an unverified peak is not a compliant one
+            reason = "Pic de bitrate inconnu (analyse des paquets en echec ou hors delai)"
+            print(f"WARNING: {reason}, re-encodage par securite: {inp.name}")
+            return False, [reason]
+        compatible, issues = check_qs02_compatibility(format_info, video, peak)
+    return compatible, issues
+
+
+def partial_path(p: Path) -> Path:
+    # "film.qs02.mkv" -> "film.qs02.part.mkv" (keeps the extension so ffmpeg picks the muxer)
+    return p.with_name(f"{p.stem}.part{p.suffix}")
+
+
+def work_dir_for(outp: Path) -> Path:
+    return outp.with_name(f".{outp.stem}.work")
+
+
+def keyframe_boundaries(ffprobe: str, inp: Path, duration: float, segment_seconds: float) -> list[float]:
+    # Nominal cut points every segment_seconds (no tiny trailing segment)
+    targets = []
+    t = segment_seconds
+    while t < duration - segment_seconds / 4:
+        targets.append(t)
+        t += segment_seconds
+    if not targets:
+        return []
+
+    # Only read a short window after each nominal cut instead of the whole file
+    intervals = ",".join(f"{t:.3f}%+{KEYFRAME_SEARCH_SECONDS}" for t in targets)
+    rc, out, _ = cap(
+        [
+            ffprobe,
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-read_intervals",
+            intervals,
+            "-show_entries",
+            "packet=pts_time,flags",
+            "-of",
+            "csv=p=0",
+            str(inp),
         ]
+    )
+    keyframes = []
+    if rc == 0:
+        for line in out.splitlines():
+            pts, _, flags = line.partition(",")
+            if "K" in flags:
+                try:
+                    keyframes.append(float(pts))
+                except ValueError:
+                    continue
+    keyframes.sort()
+
+    boundaries: list[float] = []
+    for t in targets:
+        kf = next((k for k in keyframes if t <= k < t + KEYFRAME_SEARCH_SECONDS), t)
+        if not boundaries or kf > boundaries[-1]:
+            boundaries.append(kf)
+    return boundaries
+
+
+def plan_segments(duration: float, boundaries: list[float]) -> list[tuple[float, float]]:
+    starts = [0.0] + boundaries
+    ends = boundaries + [duration]
+    return [(start, end - start) for start, end in zip(starts, ends)]
+
+
+def load_segment_plan(
+    ffprobe: str,
+    inp: Path,
+    work: Path,
+    duration: float,
+    backend: EncoderBackend,
+    bitrate: str | None = None,
+    pipeline: VideoPipeline | None = None,
+) -> list[tuple[float, float]]:
+    # The plan is persisted so that a resumed job reuses exactly the same cut points
+    plan_file = work / "plan.json"
+    settings = {"encoder": backend.encoder, "segment_seconds": SEGMENT_SECONDS, "duration": duration}
+    if bitrate:
+        settings["bitrate"] = bitrate
+    if pipeline and pipeline.size:
+        settings["size"] = list(pipeline.size)
+    if plan_file.exists():
+        try:
+            plan = json.loads(plan_file.read_text(encoding="utf-8"))
+            if plan.get("settings") == settings:
+                return [tuple(seg) for seg in plan["segments"]]
+        except (OSError, json.JSONDecodeError, KeyError):
+            pass
+        # Settings changed: committed segments are not reusable
+        shutil.rmtree(work, ignore_errors=True)
+        work.mkdir(parents=True, exist_ok=True)
+    segments = plan_segments(duration, keyframe_boundaries(ffprobe, inp, duration, SEGMENT_SECONDS))
+    plan_file.write_text(json.dumps({"settings": settings, "segments": segments}), encoding="utf-8")
+    return segments
+
+
+def segment_video_cmd(
+    ffmpeg: str,
+    inp: Path,
+    outp: Path,
+    start: float,
+    length: float,
+    hdr: bool,
+    trc: str,
+    backend: EncoderBackend,
+    bitrate: str | None = None,
+    pipeline: VideoPipeline | None = None,
+) -> list[str]:
+    cmd = [ffmpeg, "-hide_banner", "-y", *backend.device_args(), *(pipeline.decode if pipeline else [])]
+    cmd += ["-ss", f"{start:.3f}", "-i", str(inp)]
+    cmd += ["-t", f"{length:.3f}", "-map", "0:v:0", "-an", "-sn", "-dn"]
+    # Each segment starts with a half-full VBV buffer so the concatenated stream stays
+    # under maxrate/bufsize at segment boundaries
+    cmd += video_codec_args(backend, hdr, trc, vbv_init=0.5, bitrate=bitrate, pipeline=pipeline)
+    cmd += [str(outp)]
+    return cmd
 
-    # Track 0: AC3 5.1 (or 2.0) for soundbar (HT-S40R)
-    if best_audio_stream:
-        src_codec = (best_audio_stream.get("codec_name") or "").lower()
-        ch = int(best_audio_stream.get("channels") or 0)
-        target_channels = "6" if ch >= 6 else "2"
 
-        # If already AC3 with compatible channels, copy
-        if src_codec == "ac3" and ch in {2, 6}:
-            cmd += ["-c:a:0", "copy"]
-        else:
-            # Convert to AC3
-            cmd += ["-c:a:0", "ac3", "-b:a:0", AC3_BITRATE, "-ac:a:0", target_channels]
+def audio_only_cmd(ffmpeg: str, inp: Path, outp: Path, best_audio_stream: dict | None, all_streams: list[dict]) -> list[str]:
+    cmd = [ffmpeg, "-hide_banner", "-y", "-i", str(inp), "-vn", "-sn", "-dn"]
+    cmd += audio_map_args(best_audio_stream, all_streams)
+    cmd += audio_codec_args(best_audio_stream, all_streams)
+    cmd += [str(outp)]
+    return cmd
 
-        # Track 1: AAC stereo for headphones/compatibility (always downmix to stereo)
-        cmd += ["-c:a:1", "aac", "-b:a:1", AAC_BITRATE, "-ac:a:1", "2"]
 
+def concat_cmd(ffmpeg: str, inp: Path, list_file: Path, audio_file: Path | None, outp: Path) -> list[str]:
+    cmd = [ffmpeg, "-hide_banner", "-y", "-f", "concat", "-safe", "0", "-i", str(list_file)]
+    src_index = 1
+    if audio_file:
+        cmd += ["-i", str(audio_file)]
+        src_index = 2
+    cmd += ["-i", str(inp), "-map", "0:v:0"]
+    if audio_file:
+        cmd += ["-map", "1:a"]
     if KEEP_SUBS:
-        cmd += ["-c:s", "copy"]
-
-    cmd += [str(outp)]
+        cmd += ["-map", f"{src_index}:s?"]
+    cmd += ["-map_metadata", str(src_index), "-map_chapters", str(src_index), "-c", "copy", str(outp)]
     return cmd
 
 
-def main() -> None:
-    if len(sys.argv) < 2:
-        raise SystemExit(f"Usage: {sys.argv[0]} <fichier_video>")
+def parse_rate(rate: str) -> int:
+    # "25M" -> 25_000_000, "640k" -> 640_000
+    rate = rate.strip()
+    mult = {"k": 1_000, "m": 1_000_000, "g": 1_000_000_000}.get(rate[-1:].lower())
+    return int(float(rate[:-1]) * mult) if mult else int(rate)
 
-    inp_path = Path(sys.argv[1])
-    if not inp_path.exists():
-        raise SystemExit(f"ERROR: Fichier introuvable: {inp_path}")
-    if not inp_path.is_file():
-        raise SystemExit(f"ERROR: N'est pas un fichier: {inp_path}")
-    if inp_path.suffix.lower() not in VIDEO_EXTS:
-        raise SystemExit(f"ERROR: Extension non supportee: {inp_path.suffix}")
 
-    ffmpeg = need("ffmpeg")
-    ffprobe = need("ffprobe")
-    if not has_nvenc(ffmpeg):
-        raise SystemExit("ERROR: av1_nvenc non disponible (ffmpeg sans NVENC AV1).")
+# Progress listeners receive every event dict emitted by run_ffmpeg()
+progress_listeners: list[Callable[[dict], None]] = []
+_progress_log_lock = threading.Lock()
 
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
-    inp = inp_path.resolve()
 
-    streams, format_info = probe(ffprobe, inp)
-    v = first(streams, "video")
-    if not v:
-        raise SystemExit(f"SKIP (no video): {inp}")
+def add_progress_listener(listener: Callable[[dict], None]) -> None:
+    progress_listeners.append(listener)
 
-    # Select best audio stream (french > english > most channels)
-    best_audio_stream = best_audio(streams)
-    if not best_audio_stream:
-        raise SystemExit(f"SKIP (no audio): {inp}")
 
-    hdr, trc = is_hdr(v)
-    tag = "HDR" if hdr else "SDR"
+def emit_progress(event: dict) -> None:
+    event.setdefault("ts", round(time.time(), 3))
+    if PROGRESS_LOG is not None:
+        line = json.dumps(event, ensure_ascii=False)
+        with _progress_log_lock:
+            PROGRESS_LOG.parent.mkdir(parents=True, exist_ok=True)
+            with PROGRESS_LOG.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    for listener in list(progress_listeners):
+        listener(event)
 
-    # Extract movie info from filename
-    movie_title, year = extract_movie_info(inp.name)
-    resolution = get_resolution_p(v)
 
-    # Build clean output name
-    output_stem = build_output_name(movie_title, year, resolution, tag)
-    base_outp = OUT_DIR / f"{output_stem}.mkv"
+def parse_progress_value(key: str, value: str) -> float | None:
+    # out_time_us=12345678, fps=47.9, speed=1.98x, bitrate=9123.4kbits/s (or N/A)
+    value = value.strip()
+    if not value or value == "N/A":
+        return None
+    try:
+        if key == "speed":
+            return float(value.rstrip("x"))
+        if key == "bitrate":
+            return float(value.replace("kbits/s", "")) * 1000
+        return float(value)
+    except ValueError:
+        return None
 
-    # Find available filename if not overwriting
-    if OVERWRITE:
-        outp = base_outp
-    else:
-        outp = find_available_filename(base_outp)
-
-    # Create MD file with technical info (same stem as video file)
-    md_path = OUT_DIR / f"{outp.stem}.md"
-
-    # Create MD file immediately with source info and placeholder for target
-    create_md_file(
-        md_path,
-        inp,
-        inp.name,
-        v,
-        best_audio_stream,
-        streams,
-        format_info,
-        outp,
-        outp.name,
-        None,  # target_video_info - will be updated after encoding
-        None,  # target_audio_info - will be updated after encoding
-        [],  # target_streams_info - will be updated after encoding
-        {},  # target_format_info - will be updated after encoding
-    )
-    print(f"MD: {md_path} (created, will be updated after encoding)")
 
-    cmd = ffmpeg_cmd(ffmpeg, inp, outp, hdr, trc, best_audio_stream, streams)
-    print(f"\nIN  : {inp}\nOUT : {outp}\nMODE: {tag} (trc={trc})")
-    print(
-        f"AUDIO: Track 0=AC3 5.1, Track 1=AAC stereo (from {best_audio_stream.get('codec_name', 'unknown')} {best_audio_stream.get('channels', 0)}ch)"
+def run_ffmpeg(cmd: list[str], duration: float = 0.0, step: str = "") -> int:
+    # "-progress pipe:1" gives machine-readable key=value blocks on stdout; "-nostats" drops the
+    # human stats line from stderr (errors still go to the console)
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    output = cmd[-1]
+    started = time.monotonic()
+    emit_progress({"event": "start", "step": step, "output": output, "duration_s": duration})
+
+    stats: dict[str, float | None] = {}
+    last_print = started
+
+    def on_line(line: str) -> None:
+        # One call per stdout line, in this thread
+        nonlocal last_print
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return
+        if key in {"out_time_us", "fps", "speed", "bitrate", "total_size"}:
+            stats[key] = parse_progress_value(key, value)
+            return
+        if key != "progress":
+            return
+
+        # End of a progress block
+        out_time = (stats.get("out_time_us") or 0) / 1_000_000
+        elapsed = time.monotonic() - started
+        speed = stats.get("speed") or (out_time / elapsed if elapsed > 0 else None)
+        eta = max(0.0, duration - out_time) / speed if duration > 0 and speed else None
+        event = {
+            "event": "progress",
+            "step": step,
+            "output": output,
+            "out_time_s": round(out_time, 3),
+            "percent": round(min(100.0, 100 * out_time / duration), 2) if duration > 0 else None,
+            "fps": stats.get("fps"),
+            "speed": speed,
+            "bitrate": stats.get("bitrate"),
+            "size": stats.get("total_size"),
+            "elapsed_s": round(elapsed, 3),
+            "eta_s": round(eta, 1) if eta is not None else None,
+        }
+        emit_progress(event)
+        now = time.monotonic()
+        if now - last_print >= PROGRESS_PRINT_SECONDS or value.strip() == "end":
+            last_print = now
+            pct = f"{event['percent']:.1f}%" if event["percent"] is not None else "?"
+            eta_txt = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta is not None else "?"
+            print(
+                f"  {step or Path(output).name}: {pct} fps={event['fps'] or 0:.1f} "
+                f"speed={speed or 0:.2f}x ETA {eta_txt}",
+                flush=True,
+            )
+
+    rc = run(cmd, on_line=on_line, pool="encode", capture_stderr=False).returncode
+    elapsed = time.monotonic() - started
+    realtime = duration / elapsed if duration > 0 and elapsed > 0 else None
+    emit_progress(
+        {
+            "event": "end",
+            "step": step,
+            "output": output,
+            "returncode": rc,
+            "elapsed_s": round(elapsed, 3),
+            "duration_s": duration,
+            "realtime_factor": round(realtime, 3) if realtime is not None else None,
+            "below_realtime": realtime is not None and realtime < 1.0,
+        }
     )
+    if rc == 0 and realtime is not None and realtime < 1.0:
+        print(f"  WARNING: {step or Path(output).name} plus lent que le temps reel ({realtime:.2f}x)")
+    return rc
+
+
+def run_step(
+    cmd: list[str], outp: Path, duration: float = 0.0, step: str = "", extra_outputs: tuple[Path, ...] = ()
+) -> None:
+    # Write to ".part" files and only rename once ffmpeg succeeded (outp is the last argument,
+    # extra_outputs appear earlier in the command)
+    parts = {str(p): partial_path(p) for p in (*extra_outputs, outp)}
+    for tmp in parts.values():
+        tmp.unlink(missing_ok=True)
+    cmd = [str(parts[arg]) if arg in parts else arg for arg in cmd]
     if DRY_RUN:
         print("CMD:", " ".join(cmd))
         return
-    if subprocess.run(cmd).returncode != 0:
-        raise SystemExit(f"FAILED: {inp}")
+    if run_ffmpeg(cmd, duration, step) != 0:
+        for tmp in parts.values():
+            tmp.unlink(missing_ok=True)
+        raise RuntimeError(f"FAILED: {' '.join(cmd)}")
+    for final, tmp in parts.items():
+        os.replace(tmp, final)
+
+
+def encode(
+    ffmpeg: str,
+    ffprobe: str,
+    inp: Path,
+    outp: Path,
+    hdr: bool,
+    trc: str,
+    best_audio_stream: dict | None,
+    all_streams: list[dict],
+    format_info: dict,
+    backend: EncoderBackend,
+    copy_video: bool = False,
+    bitrate: str | None = None,
+    pipeline: VideoPipeline | None = None,
+    ladder: tuple[Path, VideoPipeline] | None = None,
+) -> None:
+    try:
+        duration = float(format_info.get("duration") or 0)
+    except (TypeError, ValueError):
+        duration = 0.0
+
+    if ladder:
+        low_outp, low_pipeline = ladder
+        cmd = ladder_cmd(
+            ffmpeg, inp, outp, low_outp, hdr, trc, best_audio_stream, all_streams, backend, pipeline, low_pipeline, bitrate
+        )
+        run_step(cmd, outp, duration, extra_outputs=(low_outp,))
+        return
+
+    # A remux runs at disk speed: segmenting it would only add a concat pass
+    if copy_video or SEGMENT_SECONDS <= 0 or duration <= SEGMENT_SECONDS:
+        cmd = ffmpeg_cmd(
+            ffmpeg, inp, outp, hdr, trc, best_audio_stream, all_streams, backend, copy_video, bitrate, pipeline
+        )
+        run_step(cmd, outp, duration)
+        return
+
+    # Segmented encode: every finished segment is committed in the work dir, so an
+    # interrupted job only re-encodes the segments that were in progress
+    work = work_dir_for(outp)
+    work.mkdir(parents=True, exist_ok=True)
+    segments = load_segment_plan(ffprobe, inp, work, duration, backend, bitrate, pipeline)
+    seg_files = [work / f"seg_{k:04d}.mkv" for k in range(len(segments))]
+
+    steps: list[tuple[str, list[str], Path, float]] = []
+    for k, ((start, length), seg) in enumerate(zip(segments, seg_files)):
+        if seg.exists():
+            print(f"SEGMENT {k + 1}/{len(segments)}: deja encode, reprise")
+            continue
+        label = f"SEGMENT {k + 1}/{len(segments)}: {start:.0f}s -> {start + length:.0f}s"
+        cmd = segment_video_cmd(ffmpeg, inp, seg, start, length, hdr, trc, backend, bitrate, pipeline)
+        steps.append((label, cmd, seg, length))
+
+    audio_file = None
+    if best_audio_stream:
+        audio_file = work / "audio.mka"
+        if not audio_file.exists():
+            cmd = audio_only_cmd(ffmpeg, inp, audio_file, best_audio_stream, all_streams)
+            steps.append(("AUDIO", cmd, audio_file, duration))
+
+    def run_labelled(step: tuple[str, list[str], Path, float]) -> None:
+        label, cmd, target, length = step
+        print(label)
+        run_step(cmd, target, length, label)
+
+    # Audio is cheap: it goes first so it overlaps with the video segments
+    steps.sort(key=lambda step: step[0] != "AUDIO")
+    # On Ctrl+C, kill_on_interrupt() stops the encodes before the pool waits for its threads
+    with ThreadPoolExecutor(max_workers=max(1, SEGMENT_WORKERS)) as pool, kill_on_interrupt(pool):
+        list(pool.map(run_labelled, steps))
+
+    list_file = work / "segments.txt"
+    list_file.write_text("".join(f"file '{seg.name}'\n" for seg in seg_files), encoding="utf-8")
+    run_step(concat_cmd(ffmpeg, inp, list_file, audio_file, outp), outp, duration, "CONCAT")
+    if not DRY_RUN:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+class JobSkipped(Exception):
+    pass
+
+
+def process_file(
+    ffmpeg: str,
+    ffprobe: str,
+    inp: Path,
+    backend: EncoderBackend,
+    cache: ProbeCache | None = None,
+    skip_existing: bool = False,
+    scheduler: ResourceScheduler | None = None,
+) -> Path:
+    # Probe and packet scan are the heaviest reads of a job: they wait for a disk slot like a remux
+    with scheduler.reading(inp) if scheduler else nullcontext():
+        streams, format_info = probe(ffprobe, inp, cache)
+        v = first(streams, "video")
+        if not v:
+            raise JobSkipped(f"SKIP (no video): {inp}")
+
+        # Select best audio stream (french > english > most channels)
+        best_audio_stream = best_audio(streams)
+        if not best_audio_stream:
+            raise JobSkipped(f"SKIP (no audio): {inp}")
+
+        hdr, trc = is_hdr(v)
+        tag = "HDR" if hdr else "SDR"
+
+        with METRICS.timer("nommage"):
+            # Extract movie info from filename
+            movie_title, year, season, episode, _ = parse_release_name(inp.name)
+            episode = episode_tag(season, episode)
+            size = scaled_size(v, MAX_HEIGHT)
+            resolution = f"{size[1]}p" if size else get_resolution_p(v)
+
+            # Build clean output name
+            output_stem = build_output_name(movie_title, year, resolution, tag, episode)
+        base_outp = OUT_DIR / f"{output_stem}.mkv"
+        if skip_existing and not OVERWRITE and base_outp.exists():
+            raise JobSkipped(f"SKIP (deja produit): {base_outp}")
+
+        # Find available filename if not overwriting
+        if OVERWRITE:
+            outp = base_outp
+        else:
+            outp = find_available_filename(base_outp)
+
+        copy_video, issues = video_copy_decision(ffprobe, inp, v, format_info, cache)
+        low_size = ladder_size(v)
+    # The scheduler may wait for a free slot and place the job on another GPU or a software encoder
+    # (a remux with a ladder variant still encodes)
+    with scheduler.slot(inp, copy_video and not low_size) if scheduler else nullcontext(backend) as backend:
+        if copy_video:
+            video_action = "copie (source deja compatible QS02, pas de re-encodage)"
+        else:
+            video_action = f"re-encodage {backend.encoder} ({'; '.join(issues)})"
+        METRICS.count("video_copiee" if copy_video else "video_reencodee")
+        pipeline = None if copy_video else plan_video_pipeline(backend, v, hdr, list_filters(ffmpeg), MAX_HEIGHT)
+        # The rate follows the encoded size, not the source one (MAX_HEIGHT)
+        bitrate, bitrate_reason = target_bitrate(v, streams, format_info, hdr, pipeline.size if pipeline else None)
+        if backend.capped_crf:
+            bitrate_reason = f"non utilise par {backend.encoder}: CRF {SVTAV1_CRF} plafonne a MAXRATE"
+        ladder = None
+        if low_size:
+            pipeline, low_pipeline = plan_ladder(backend, v, hdr, list_filters(ffmpeg), pipeline)
+            low_base = OUT_DIR / f"{build_output_name(movie_title, year, f'{low_size[1]}p', tag, episode)}.mkv"
+            ladder = (low_base if OVERWRITE else find_available_filename(low_base), low_pipeline)
+        # Calibration searches a bitrate: nothing to search with a capped CRF encoder
+        if CALIBRATE and not copy_video and not DRY_RUN and not backend.capped_crf:
+            try:
+                duration = float(format_info.get("duration") or 0)
+            except (TypeError, ValueError):
+                duration = 0.0
+            calibrated = None
+            if duration > 0:
+                calibrated = calibrate_bitrate(ffmpeg, inp, outp, hdr, trc, backend, duration, cache, pipeline)
+            if calibrated:
+                bitrate, bitrate_reason = calibrated
+            else:
+                print("WARNING: calibration impossible, bitrate non calibre conserve")
+        encoder_label = f"{backend.encoder} {bitrate}, {pipeline.describe()}" if pipeline else backend.encoder
+        stream_plan = plan_streams(best_audio_stream, streams, copy_video, issues, encoder_label)
+        if ladder:
+            low_bitrate = LADDER_BITRATE_HDR if hdr else LADDER_BITRATE_SDR
+            stream_plan.append(
+                f"variante {low_size[1]}p ({ladder[0].name}): transcodage {backend.encoder} {low_bitrate}, "
+                f"{ladder[1].describe()}, meme decodage"
+            )
+
+        # Create MD file with technical info (same stem as video file)
+        md_path = OUT_DIR / f"{outp.stem}.md"
+
+        # Create MD file immediately with source info and placeholder for target
+        with METRICS.timer("markdown"):
+            create_md_file(
+                md_path,
+                inp,
+                inp.name,
+                v,
+                best_audio_stream,
+                streams,
+                format_info,
+                outp,
+                outp.name,
+                None,  # target_video_info - will be updated after encoding
+                None,  # target_audio_info - will be updated after encoding
+                [],  # target_streams_info - will be updated after encoding
+                {},  # target_format_info - will be updated after encoding
+                video_action,
+                stream_plan,
+            )
+        print(f"MD: {md_path} (created, will be updated after encoding)")
+
+        print(f"\nIN  : {inp}\nOUT : {outp}\nMODE: {tag} (trc={trc}, encodeur={'copy' if copy_video else backend.encoder})")
+        print(f"VIDEO: {video_action}")
+        if not copy_video:
+            print(f"BITRATE: {bitrate} ({bitrate_reason})")
+        print("PLAN:")
+        for line in stream_plan:
+            print(f"  - {line}")
+        with METRICS.timer("remux" if copy_video and not ladder else "encodage", int(format_info.get("size") or 0)):
+            encode(
+                ffmpeg,
+                ffprobe,
+                inp,
+                outp,
+                hdr,
+                trc,
+                best_audio_stream,
+                streams,
+                format_info,
+                backend,
+                copy_video,
+                bitrate,
+                pipeline,
+                ladder,
+            )
+    if DRY_RUN:
+        return outp
 
     # Analyze target file after successful encoding
-    target_streams, target_format_info = probe(ffprobe, outp)
+    with METRICS.timer("probe_cible"):
+        target_streams, target_format_info = probe(ffprobe, outp)
     target_v = first(target_streams, "video")
     if not target_v:
-        raise SystemExit(f"SKIP (no video in target): {outp}")
+        raise RuntimeError(f"SKIP (no video in target): {outp}")
     target_audio_streams = [s for s in target_streams if s.get("codec_type") == "audio"]
     target_a_ac3 = target_audio_streams[0] if len(target_audio_streams) > 0 else None
 
     # Update MD file with target info after successful encoding
-    create_md_file(
-        md_path,
-        inp,
-        inp.name,
-        v,
-        best_audio_stream,
-        streams,
-        format_info,
-        outp,
-        outp.name,
-        target_v,
-        target_a_ac3,
-        target_streams,
-        target_format_info,
-    )
+    with METRICS.timer("markdown"):
+        create_md_file(
+            md_path,
+            inp,
+            inp.name,
+            v,
+            best_audio_stream,
+            streams,
+            format_info,
+            outp,
+            outp.name,
+            target_v,
+            target_a_ac3,
+            target_streams,
+            target_format_info,
+            video_action,
+            stream_plan,
+        )
     print(f"MD: {md_path} (updated)")
+    return outp
+
+
+class JobQueue:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.jobs: dict[str, dict] = {}
+        if path.exists():
+            try:
+                self.jobs = json.loads(path.read_text(encoding="utf-8")).get("jobs", {})
+            except (OSError, json.JSONDecodeError):
+                print(f"WARNING: file de jobs illisible, recreee: {path}")
+        # Jobs left "running" by an interrupted batch are resumed
+        for job in self.jobs.values():
+            if job.get("status") == "running":
+                job["status"] = "pending"
+
+    def add(self, source: Path) -> None:
+        with self._lock:
+            self.jobs.setdefault(str(source), {"status": "pending", "output": None, "error": None})
+
+    def todo(self) -> list[Path]:
+        return [Path(src) for src, job in self.jobs.items() if job["status"] in {"pending", "failed"}]
+
+    def set(self, source: Path, status: str, output: Path | None = None, error: str | None = None) -> None:
+        with self._lock:
+            self.jobs[str(source)] = {
+                "status": status,
+                "output": str(output) if output else None,
+                "error": error,
+                "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            self.save()
+
+    def save(self) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"version": 1, "jobs": self.jobs}, ensure_ascii=False, indent=1), encoding="utf-8")
+        tmp.replace(self.path)
+
+
+class ResourceScheduler:
+    # Hands out GPU encoder sessions, CPU cores and disk slots; waiting jobs are served by rank
+    def __init__(
+        self,
+        hw_backend: EncoderBackend | None,
+        sw_backend: EncoderBackend | None,
+        ranks: dict[str, int],
+    ) -> None:
+        self.hw_backend = hw_backend
+        self.sw_backend = sw_backend
+        self.ranks = ranks
+        self.gpu_free = dict(SCHEDULER_GPU_SESSIONS) if hw_backend else {}
+        self.cores_total = SCHEDULER_CPU_CORES or os.cpu_count() or 4
+        self.cores_free = self.cores_total
+        self.io_free = SCHEDULER_IO_SLOTS
+        # Encoders a job runs at once: SEGMENT_WORKERS segments, and CALIBRATION_WORKERS clips
+        # before the encode (same slot)
+        self.parallel = max(1, SEGMENT_WORKERS) if SEGMENT_SECONDS > 0 else 1
+        if CALIBRATE:
+            self.parallel = max(self.parallel, CALIBRATION_WORKERS)
+        self._cond = threading.Condition()
+        self._waiting: dict[int, str] = {}
+        self._check_fits()
+
+    def _check_fits(self) -> None:
+        # A job that no resource can ever hold would wait forever: refuse the configuration up front
+        if self.io_free < 1:
+            raise SystemExit("ERROR: SCHEDULER_IO_SLOTS doit valoir au moins 1 (lecture des sources, remux)")
+        if self.sw_backend or any(n >= self.parallel for n in self.gpu_free.values()):
+            return
+        if not self.gpu_free:
+            raise SystemExit(
+                "ERROR: ordonnanceur sans ressource d'encodage: pas d'encodeur GPU (ou SCHEDULER_GPU_SESSIONS "
+                "vide) et SCHEDULER_SOFTWARE_ENCODER = None"
+            )
+        raise SystemExit(
+            f"ERROR: un job prend {self.parallel} sessions GPU (SEGMENT_WORKERS / CALIBRATION_WORKERS) mais "
+            f"un GPU en offre au plus {max(self.gpu_free.values())} (SCHEDULER_GPU_SESSIONS) et SCHEDULER_SOFTWARE_ENCODER = None"
+        )
+
+    @property
+    def capacity(self) -> int:
+        # Upper bound of simultaneous jobs, used to size the thread pool
+        encodes = sum(n // self.parallel for n in self.gpu_free.values())
+        if self.sw_backend:
+            encodes += self.cores_total // self.cores(SCHEDULER_CORES_SOFTWARE)
+        return max(1, encodes + self.io_free)
+
+    def cores(self, per_encoder: int) -> int:
+        # Never ask for more than the host has, or the job would wait forever
+        return min(self.cores_total, per_encoder * self.parallel)
+
+    def _pick(self, kind: str) -> tuple[str, int | None, int] | None:
+        # kind "io" (source read, remux) or "encode": (resource, gpu index, cores) or None when
+        # nothing fits right now
+        if kind == "io":
+            return ("io", None, 1) if self.io_free > 0 and self.cores_free >= 1 else None
+        cores = self.cores(SCHEDULER_CORES_HARDWARE)
+        if self.cores_free >= cores:
+            # Least loaded GPU first
+            gpus = [g for g, n in self.gpu_free.items() if n >= self.parallel]
+            if gpus:
+                return "gpu", max(gpus, key=lambda g: self.gpu_free[g]), cores
+        cores = self.cores(SCHEDULER_CORES_SOFTWARE)
+        if self.sw_backend and self.cores_free >= cores:
+            return "cpu", None, cores
+        return None
+
+    def _take(self, slot: tuple[str, int | None, int], delta: int) -> None:
+        kind, gpu, cores = slot
+        self.cores_free -= cores * delta
+        if kind == "io":
+            self.io_free -= delta
+        elif kind == "gpu":
+            self.gpu_free[gpu] -= self.parallel * delta
+
+    def _acquire(self, inp: Path, kind: str) -> tuple[str, int | None, int]:
+        rank = self.ranks.get(str(inp), len(self.ranks))
+        with self._cond:
+            self._waiting[rank] = kind
+            # A better ranked job that fits goes first; others may use what it cannot (backfill)
+            while (slot := self._pick(kind)) is None or any(r < rank and self._pick(k) for r, k in self._waiting.items()):
+                self._cond.wait()
+            del self._waiting[rank]
+            self._take(slot, 1)
+            self._cond.notify_all()
+        return slot
+
+    def _release(self, slot: tuple[str, int | None, int]) -> None:
+        with self._cond:
+            self._take(slot, -1)
+            self._cond.notify_all()
+
+    @contextmanager
+    def reading(self, inp: Path):
+        # ffprobe and the packet scan read the source like a remux does: same disk slots
+        slot = self._acquire(inp, "io")
+        try:
+            yield
+        finally:
+            self._release(slot)
+
+    @contextmanager
+    def slot(self, inp: Path, copy_video: bool):
+        slot = self._acquire(inp, "io" if copy_video else "encode")
+        kind, gpu, _ = slot
+        if kind == "gpu":
+            backend = self.hw_backend.on_gpu(gpu)
+        elif kind == "cpu":
+            backend = self.sw_backend
+        else:
+            backend = self.hw_backend or self.sw_backend
+        METRICS.count(f"slot_{kind}" if gpu is None else f"slot_gpu{gpu}")
+        try:
+            yield backend
+        finally:
+            self._release(slot)
+
+
+def load_watchlist(path: Path | None) -> list[str]:
+    if path is None:
+        return []
+    try:
+        lines = Path(path).read_text(encoding="utf-8").splitlines()
+    except OSError as e:
+        print(f"WARNING: watchlist illisible ({path}): {e}")
+        return []
+    return [line.strip().lower() for line in lines if line.strip() and not line.startswith("#")]
+
+
+def prioritize(sources: list[Path], criteria: list[str], watchlist: list[str]) -> list[Path]:
+    def key(src: Path) -> tuple:
+        try:
+            st = src.stat()
+            size, mtime = st.st_size, st.st_mtime
+        except OSError:
+            size, mtime = 0, 0.0
+        name = src.name.lower()
+        parts = {
+            "watchlist": 0 if any(w in name for w in watchlist) else 1,
+            "smallest": size,
+            "largest": -size,
+            "recent": -mtime,
+        }
+        return tuple(parts[c] for c in criteria if c in parts)
+
+    return sorted(sources, key=key)
+
+
+def collect_sources(target: Path) -> list[Path]:
+    if target.suffix.lower() == ".tsv":
+        # Inventory TSV (QS02_inventaire): only "NON OK" rows need work
+        sources = []
+        with target.open(encoding="utf-8") as f:
+            next(f, None)
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) > 1 and cols[0] == "NON OK":
+                    sources.append(Path(cols[1]))
+        return sources
+    # Whole path components: "out" must not hide "out2/" or "outtakes/"
+    out_dir = OUT_DIR.resolve()
+    return [Path(e.path) for e in scan_video_files(target.resolve()) if not Path(e.path).is_relative_to(out_dir)]
+
+
+def run_batch(target: Path) -> None:
+    ffmpeg = need("ffmpeg")
+    ffprobe = need("ffprobe")
+    backend = select_backend(ffmpeg)
+    print(f"Encodeur video: {backend.encoder}")
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    queue = JobQueue(JOBS_FILE)
+    sources = [src.resolve() for src in collect_sources(target)]
+    for src in sources:
+        queue.add(src)
+    queue.save()
+    todo = queue.todo()
+    print(f"Batch: {len(queue.jobs)} job(s), {len(todo)} a traiter ({JOBS_FILE})")
+
+    scheduler = None
+    workers = BATCH_WORKERS
+    if SCHEDULER:
+        todo = prioritize(todo, SCHEDULER_PRIORITY, load_watchlist(WATCHLIST_FILE))
+        sw_backend = None
+        if SCHEDULER_SOFTWARE_ENCODER:
+            sw_backend = backend if not backend.hardware else select_backend(ffmpeg, SCHEDULER_SOFTWARE_ENCODER)
+        hw_backend = backend if backend.hardware else None
+        scheduler = ResourceScheduler(hw_backend, sw_backend, {str(src): i for i, src in enumerate(todo)})
+        workers = scheduler.capacity
+        gpus = ", ".join(f"gpu{g}x{n}" for g, n in scheduler.gpu_free.items()) or "aucun GPU"
+        print(
+            f"Ordonnanceur: {gpus}, logiciel={sw_backend.encoder if sw_backend else 'non'}, "
+            f"{scheduler.cores_total} coeurs, {scheduler.io_free} slot(s) disque, {workers} job(s) max"
+        )
+
+    cache = open_cache(PROBE_CACHE_FILE)
+
+    def run_job(inp: Path) -> str:
+        if not inp.exists():
+            queue.set(inp, "failed", error="source introuvable")
+            return "failed"
+        queue.set(inp, "running")
+        try:
+            outp = process_file(ffmpeg, ffprobe, inp, backend, cache, skip_existing=True, scheduler=scheduler)
+        except JobSkipped as e:
+            print(e)
+            queue.set(inp, "skipped", error=str(e))
+            return "skipped"
+        except RunInterrupted:
+            # Ctrl+C: the job is not failed, the next run starts it again
+            queue.set(inp, "pending")
+            return "interrupted"
+        except Exception as e:
+            print(f"ERROR: {e}")
+            queue.set(inp, "failed", error=str(e))
+            return "failed"
+        queue.set(inp, "pending" if DRY_RUN else "done", output=outp)
+        return "done"
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool, kill_on_interrupt(pool):
+            statuses = list(pool.map(run_job, todo))
+        if cache and target.is_dir():
+            # Like the inventory: forget the files that left the scanned folder
+            pruned = cache.prune(target, {str(src) for src in sources})
+            if pruned:
+                print(f"Cache ffprobe: {pruned} entree(s) obsolete(s) supprimee(s)")
+    finally:
+        if cache:
+            cache.close()
+
+    print(
+        f"\nBatch termine: {statuses.count('done')} ok, {statuses.count('skipped')} ignore(s), "
+        f"{statuses.count('failed')} echec(s)"
+    )
+    report_metrics()
+
+
+def report_metrics() -> None:
+    METRICS.print_summary()
+    if METRICS_FILE:
+        METRICS.write(METRICS_FILE)
+        print(f"Metriques: {METRICS_FILE}")
+
+
+def main() -> None:
+    target = Path(sys.argv[1]) if len(sys.argv) > 1 else IN_DIR
+    if not target.exists():
+        raise SystemExit(f"ERROR: Fichier introuvable: {target}")
+    if target.is_dir() or target.suffix.lower() == ".tsv":
+        run_batch(target)
+        return
+    if not target.is_file():
+        raise SystemExit(f"ERROR: N'est pas un fichier: {target}")
+    if target.suffix.lower() not in VIDEO_EXTS:
+        raise SystemExit(f"ERROR: Extension non supportee: {target.suffix}")
+
+    ffmpeg = need("ffmpeg")
+    ffprobe = need("ffprobe")
+    backend = select_backend(ffmpeg)
+    print(f"Encodeur video: {backend.encoder}")
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    cache = open_cache(PROBE_CACHE_FILE)
+    try:
+        process_file(ffmpeg, ffprobe, target.resolve(), backend, cache)
+    except (JobSkipped, RuntimeError) as e:
+        raise SystemExit(str(e))
+    finally:
+        if cache:
+            cache.close()
+    report_metrics()
 
 
 if __name__ == "__main__":